@@ -1,52 +1,666 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Response, g, render_template, request, jsonify, redirect, send_file
 import requests
 import random
 import os
-from io import BytesIO
-from bs4 import BeautifulSoup
+import logging
+import time
+import hashlib
+import math
+from collections.abc import Mapping
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+from urllib.parse import quote
+
+import http_client
+from bulk_zip import BULK_MAX_ITEMS, stream_zip
+from cache import response_cache
+from cursors import CursorPager, InvalidCursor, decode_cursor
+from extractors import extract_figure_images
+from health import CLOSED, CircuitOpenError, provider_health
+from likes import like_store
+import metrics
+from metrics import count_images, record_span, span
+from neko_pool import neko_pool
+from prefetch import Prefetcher
+from responses import dumps, encode_json, public_payload
+from ratelimit import PRIORITY_BACKGROUND, PRIORITY_FIRST_PAGE, PRIORITY_USER, RateLimitedError, rate_limiter
+from search_index import SearchIndex
+from thumbnails import THUMB_DEFAULT_WIDTH, is_allowed, pick_width, thumb_url, thumbnail_cache
+from wallpaper_pool import WallpaperPool
 
 
 app = Flask(__name__)
 
+metrics.configure_logging()
+logger = logging.getLogger("pixerest")
+
 
 # KEYS TO ACCESS THE IMAGES
 UNSPLASH_ACCESS_KEY = os.environ.get("UNSPLASH_ACCESS_KEY")
 PEXELS_API_KEY = os.environ.get("PEXELS_API_KEY")  
 
 
+# PROVIDER ENDPOINTS
+# Overridable so the benchmark suite (bench/) can point the app at local stand-ins.
+UNSPLASH_API_URL = os.environ.get("UNSPLASH_API_URL", "https://api.unsplash.com")
+PEXELS_API_URL = os.environ.get("PEXELS_API_URL", "https://api.pexels.com/v1")
+ARTIC_API_URL = os.environ.get("ARTIC_API_URL", "https://api.artic.edu/api/v1")
+WALLPAPERFLARE_URL = os.environ.get("WALLPAPERFLARE_URL", "https://www.wallpaperflare.com")
+
+
+# PROVIDER FAN-OUT
+# Providers are queried in parallel. Each one has its own deadline (seconds) and
+# the whole fan-out is bounded by REQUEST_DEADLINE; late providers are reported
+# as timed out and the page is built from whatever arrived in time.
+REQUEST_DEADLINE = float(os.environ.get("REQUEST_DEADLINE", 6))
+PROVIDER_TIMEOUT = float(os.environ.get("PROVIDER_TIMEOUT", 4))
+PROVIDER_DEADLINES = {
+    name: float(os.environ.get(f"{name.upper()}_DEADLINE", PROVIDER_TIMEOUT))
+    for name in ("unsplash", "pexels", "nekos", "artic")
+}
+PROVIDER_WORKERS = int(os.environ.get("PROVIDER_WORKERS", 16))
+
+provider_executor = ThreadPoolExecutor(max_workers=PROVIDER_WORKERS, thread_name_prefix="provider")
+
+NEKO_QUERY_WORDS = ["anime", "cat", "neko", "cute", "pixel"]
+
+# Largest page each API serves, and how many of its pages /related_images may
+# walk through to fill a page from a single source.
+PROVIDER_PAGE_SIZES = {"unsplash": 30, "pexels": 80, "nekos": 25, "artic": 100}
+RELATED_MAX_PAGES = int(os.environ.get("RELATED_MAX_PAGES", 4))
+
+# Most (query, page) pairs one /images/stream call may ask for.
+STREAM_MAX_REQUESTS = int(os.environ.get("STREAM_MAX_REQUESTS", 4))
+
+# Largest per_page /images and /images/stream accept.
+IMAGES_MAX_PER_PAGE = int(os.environ.get("IMAGES_MAX_PER_PAGE", 100))
+
+# Items requested per provider call when filling a cursor buffer. Nekos is
+# planned like on /images but left out of cursor feeds (see cursor_providers).
+CURSOR_FETCH_SIZES = {"unsplash": 30, "pexels": 30, "nekos": 8, "artic": 30}
+
+
+# DOWNLOAD PROXY
+# Downloads are streamed straight through; nothing larger than one chunk is
+# held in memory. DOWNLOAD_RATE_LIMIT is bytes/second per download (0 = off).
+DOWNLOAD_MAX_BYTES = int(os.environ.get("DOWNLOAD_MAX_BYTES", 50 * 1024 * 1024))
+DOWNLOAD_RATE_LIMIT = int(os.environ.get("DOWNLOAD_RATE_LIMIT", 0))
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get("DOWNLOAD_CHUNK_SIZE", 64 * 1024))
+
+# Rendered thumbnails never change for a given url/width, so browsers may keep them.
+THUMB_MAX_AGE = int(os.environ.get("THUMB_MAX_AGE", 30 * 24 * 3600))
+
+# How long browsers may reuse image lists (seconds); they revalidate with the
+# ETag afterwards, which costs a 304 when the list has not changed.
+IMAGES_MAX_AGE = int(os.environ.get("IMAGES_MAX_AGE", 60))
+WALLPAPER_MAX_AGE = int(os.environ.get("WALLPAPER_MAX_AGE", 300))
+
+
 RANDOM_WALLPAPER_QUERIES = [
     'nature', 'abstract', 'space', 'city', 'ocean', 'mountain', 'sunset', 
     'forest', 'anime', 'cars', 'technology', 'art', 'landscape', 'minimalist',
     'dark', 'colorful', 'fantasy', 'architecture', 'flowers', 'animals'
 ]
 
-def fetch_wallpaperflare_images(query, page=1):
-    query = query.replace(' ', '+')
-    url = f"https://www.wallpaperflare.com/search?wallpaper={query}&page={page}"
-    headers = {
+class DownloadTooLargeError(Exception):
+    """An upstream body without Content-Length ran past the download limit mid-stream."""
+
+
+class ProviderError(Exception):
+    """Raised when a provider answers with a non-OK response."""
+
+
+WALLPAPERFLARE_HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.0.0 Safari/537.36",
     "Referer": "https://www.google.com/"
-    }
+}
 
-    try:
-        response = requests.get(url, headers=headers, timeout=10)
+def wallpaperflare_url(query, page=1):
+    query = query.replace(' ', '+')
+    return f"{WALLPAPERFLARE_URL}/search?wallpaper={query}&page={page}"
+
+def scrape_wallpaperflare(query, page=1, limit=None):
+    url = wallpaperflare_url(query, page)
+
+    with metrics.provider_latency.time("wallpaperflare"), \
+            http_client.get(url, headers=WALLPAPERFLARE_HEADERS, timeout=10, stream=True) as response:
+        metrics.upstream_responses.inc("wallpaperflare", str(response.status_code))
         if response.status_code != 200:
-            print(f"Failed to load WallpaperFlare page: {response.status_code}")
-            return []
+            raise ProviderError(f"Failed to load WallpaperFlare page: {response.status_code}")
+
+        return extract_figure_images(response.iter_content(chunk_size=16384), limit)
 
-        soup = BeautifulSoup(response.text, "html.parser")
-        images = []
+def wallpaperflare_records(query, urls):
+    return [{
+        "url": img_url,
+        "thumbnail": img_url,
+        "source": "wallpaperflare",
+        "alt": query,
+        "author": "WallpaperFlare",
+        "likes": 0
+    } for img_url in urls]
 
-        for fig in soup.find_all("figure"):
-            img = fig.find("img")
-            if img and "data-src" in img.attrs:
-                images.append(img["data-src"])
+def fetch_wallpaperflare_images(query, page=1, limit=None):
+    def fetch():
+        urls = provider_health.call("wallpaperflare", lambda: scrape_wallpaperflare(query, page, limit), 10)
+        # Only an untruncated scrape is the page as WallpaperFlare lists it.
+        search_index.harvest(query, wallpaperflare_records(query, urls), page if limit is None else None)
+        return urls
 
-        return images
+    try:
+        key = cache_key("wallpaperflare", query, page, limit or 0)
+        return response_cache.get_or_fetch(key, fetch)
     except Exception as e:
-        print(f"Error fetching images from WallpaperFlare: {e}")
+        logger.warning("wallpaperflare fetch failed query=%r page=%s: %s", query, page, e)
         return []
 
+# Each JSON provider is a (build request, parse response) pair so the same
+# logic serves the sync requests path here and the async path in asgi.py.
+
+def unsplash_request(query, page, per_page, limit):
+    unsplash_params = {
+        "page": page,
+        "per_page": limit,
+        "client_id": UNSPLASH_ACCESS_KEY
+    }
+
+    if query:
+        unsplash_params["query"] = query
+        unsplash_url = f"{UNSPLASH_API_URL}/search/photos"
+    else:
+        unsplash_url = f"{UNSPLASH_API_URL}/photos"
+
+    return unsplash_url, unsplash_params, {}
+
+
+def parse_unsplash(data, query, per_page, limit):
+    results = data.get("results", []) if query else data
+    images = [{
+        "url": img["urls"]["regular"],
+        "thumbnail": img["urls"]["small"],
+        "source": "unsplash",
+        "alt": img.get("alt_description", "Unsplash image"),
+        "author": img["user"]["name"] if "user" in img else "Unknown",
+        "likes": img.get("likes", 0)
+    } for img in results[:limit]]
+
+    return {
+        "images": images,
+        "count": len(results),
+        "total_pages": data.get("total_pages", 1) if query else 50
+    }
+
+
+def pexels_request(query, page, per_page, limit):
+    headers = {"Authorization": PEXELS_API_KEY}
+    pexels_params = {
+        "per_page": limit,
+        "page": page
+    }
+
+    if query:
+        pexels_params["query"] = query
+        pexels_url = f"{PEXELS_API_URL}/search"
+    else:
+        pexels_url = f"{PEXELS_API_URL}/curated"
+
+    return pexels_url, pexels_params, headers
+
+
+def parse_pexels(data, query, per_page, limit):
+    photos = data.get("photos", [])
+    images = [{
+        "url": img["src"]["large"],
+        "thumbnail": img["src"]["medium"],
+        "source": "pexels",
+        "alt": img.get("alt", "Pexels image"),
+        "author": img.get("photographer", "Unknown"),
+        "likes": 0
+    } for img in photos[:limit]]
+
+    return {
+        "images": images,
+        "count": len(photos),
+        "total_pages": (data.get("total_results", 500) // per_page) + 1
+    }
+
+
+def artic_request(query, page, per_page, limit):
+    chicago_params = {
+        "limit": limit,
+        "page": page,
+        "fields": "image_id,title,artist_title"
+    }
+
+    if query:
+        chicago_params["q"] = query
+        chicago_url = f"{ARTIC_API_URL}/artworks/search"
+    else:
+        chicago_url = f"{ARTIC_API_URL}/artworks"
+
+    return chicago_url, chicago_params, {}
+
+
+def parse_artic(data, query, per_page, limit):
+    artworks = data.get("data", [])
+    images = []
+    for art in artworks:
+        img_id = art.get("image_id")
+        if img_id:
+            images.append({
+                "url": f"https://www.artic.edu/iiif/2/{img_id}/full/843,/0/default.jpg",
+                "thumbnail": f"https://www.artic.edu/iiif/2/{img_id}/full/400,/0/default.jpg",
+                "source": "artic",
+                "alt": art.get("title", "Art Institute artwork"),
+                "author": art.get("artist_title", "Unknown Artist"),
+                "likes": 0
+            })
+
+    return {"images": images, "count": len(artworks), "total_pages": 1}
+
+
+JSON_PROVIDERS = {
+    "unsplash": ("Unsplash", unsplash_request, parse_unsplash),
+    "pexels": ("Pexels", pexels_request, parse_pexels),
+    "artic": ("Art Institute", artic_request, parse_artic),
+}
+
+
+def call_json_provider(name, query, page, per_page, limit):
+    label, build_request, parse = JSON_PROVIDERS[name]
+    url, params, headers = build_request(query, page, per_page, limit)
+
+    logger.debug("calling %s url=%s", label, url)
+    with metrics.provider_latency.time(name):
+        response = http_client.get(url, params=params, headers=headers, timeout=provider_deadline(name))
+    metrics.upstream_responses.inc(name, str(response.status_code))
+    rate_limiter.observe(name, response.status_code, response.headers)
+
+    if not response.ok:
+        # Error bodies can be whole HTML pages; keep enough to recognise the problem.
+        raise ProviderError(f"Status {response.status_code}: {response.text[:200]}")
+
+    return parse(response.json(), query, per_page, limit)
+
+
+def fetch_nekos(query, page, per_page, limit):
+    # Served from the prefetched pool; the request path never calls nekos.life.
+    images = [{
+        "url": url,
+        "thumbnail": url,
+        "source": "nekos",
+        "alt": "Neko anime image",
+        "author": "Nekos.life",
+        "likes": 0
+    } for url in neko_pool.take(limit)]
+
+    return {"images": images, "count": len(images), "total_pages": 1}
+
+
+PROVIDERS = {
+    "unsplash": partial(call_json_provider, "unsplash"),
+    "pexels": partial(call_json_provider, "pexels"),
+    "nekos": fetch_nekos,
+    "artic": partial(call_json_provider, "artic"),
+}
+
+# Providers answered from in-process data; they skip the cache and breaker.
+LOCAL_PROVIDERS = {"nekos"}
+
+
+def cache_key(provider, query, page, limit):
+    return f"{provider}|{query.strip().lower()}|{page}|{limit}"
+
+
+def cached_provider_call(name, query, page, per_page, limit, priority=PRIORITY_USER):
+    if name in LOCAL_PROVIDERS:
+        return PROVIDERS[name](query, page, per_page, limit)
+    key = cache_key(name, query, page, f"{limit}/{per_page}")
+
+    def fetch():
+        # Checked before the breaker: skipping a call we cannot afford is not a provider failure.
+        rate_limiter.acquire(name, priority)
+        try:
+            result = provider_health.call(
+                name, lambda: PROVIDERS[name](query, page, per_page, limit), provider_deadline(name))
+        except CircuitOpenError:
+            # The breaker skipped the call, so nothing was spent upstream.
+            rate_limiter.refund(name)
+            raise
+        search_index.harvest(query, result["images"])
+        return result
+
+    try:
+        return response_cache.get_or_fetch(key, fetch)
+    except RateLimitedError:
+        stale = response_cache.peek(key)
+        if stale is None:
+            raise
+        logger.info("%s over its rate budget, serving an expired cache entry", name)
+        return stale
+
+
+def provider_deadline(name):
+    return min(PROVIDER_DEADLINES.get(name, PROVIDER_TIMEOUT), REQUEST_DEADLINE)
+
+
+def provider_enabled(name):
+    if name == "unsplash":
+        return bool(UNSPLASH_ACCESS_KEY) and UNSPLASH_ACCESS_KEY != "your_unsplash_access_key_here" # Set your unsplash key env not set
+    if name == "pexels":
+        return bool(PEXELS_API_KEY) and PEXELS_API_KEY != "your_pexels_api_key_here" # Set your pexels key env not set
+    return name in PROVIDERS
+
+
+def plan_providers(query, quotas):
+    """Return the providers that should be queried, mapped to their item limit."""
+    plan = {}
+    if provider_enabled("unsplash"):
+        plan["unsplash"] = quotas["unsplash"]
+    else:
+        logger.debug("unsplash skipped: API key not configured")
+
+    if provider_enabled("pexels"):
+        plan["pexels"] = quotas["pexels"]
+    else:
+        logger.debug("pexels skipped: API key not configured")
+
+    if not query or any(word in query.lower() for word in NEKO_QUERY_WORDS):
+        plan["nekos"] = quotas["nekos"]
+
+    plan["artic"] = quotas["artic"]
+    # Slow providers contribute fewer items (see health.SLOW_LATENCY).
+    return {name: provider_health.quota(name, limit) for name, limit in plan.items() if limit > 0}
+
+
+def page_quotas(per_page):
+    """Items each provider contributes to one /images page."""
+    return {
+        "unsplash": min(per_page // 4, 10),
+        "pexels": min(per_page // 4, 15),
+        "nekos": min(3, per_page // 8),
+        "artic": min(per_page // 6, 8),
+    }
+
+
+def internal_quotas(per_page):
+    """Items each provider contributes to fetch_images_internal."""
+    return {
+        "unsplash": min(per_page // 2, 50),
+        "pexels": min(per_page // 2, 50),
+        "nekos": min(per_page // 4, 25),
+        "artic": min(per_page // 4, 25),
+    }
+
+
+def fetch_source_images(source, query, page, per_page):
+    """Fill ``per_page`` items from one provider, walking its pages as needed.
+
+    Returns ``(images, exhausted)``; ``exhausted`` is True when the provider
+    ran out of results (or failed) before the page was full. Related page
+    ``page`` owns provider pages ``(page - 1) * RELATED_MAX_PAGES + 1`` onwards,
+    so consecutive related pages never re-read the same provider page.
+    """
+    page_size = min(per_page, PROVIDER_PAGE_SIZES[source])
+    started = time.monotonic()
+    images = []
+    seen = set()
+    first_page = (max(page, 1) - 1) * RELATED_MAX_PAGES + 1
+
+    for source_page in range(first_page, first_page + RELATED_MAX_PAGES):
+        if time.monotonic() - started > REQUEST_DEADLINE:
+            return images, False
+        try:
+            result = cached_provider_call(source, query, source_page, page_size, page_size, PRIORITY_BACKGROUND)
+        except Exception as e:
+            logger.warning("%s failed in related fetch: %s", source, e)
+            return images, True
+
+        for img in result["images"]:
+            if img["url"] not in seen:
+                seen.add(img["url"])
+                images.append(img)
+        if len(images) >= per_page:
+            return images[:per_page], False
+        if result["count"] < page_size:
+            return images, True
+
+    return images, False
+
+
+def warm_page(query, page, per_page):
+    """Load an /images page into the response cache without serving it."""
+    # Same plan as gather_page, so the warmed cache keys are the ones it asks for.
+    _, plan = page_plan(query, page, per_page)
+    plan = {name: limit for name, limit in plan.items() if name not in LOCAL_PROVIDERS}
+    gather_providers(query, page, per_page, plan, priority=PRIORITY_BACKGROUND)
+
+
+def page_priority(page):
+    """Rate budget priority for a user-facing page: first pages are served last-token."""
+    return PRIORITY_FIRST_PAGE if page == 1 else PRIORITY_USER
+
+
+def submit_providers(query, page, per_page, plan, pages=None, tag=None, priority=PRIORITY_USER):
+    """Start every planned provider call on the shared pool.
+
+    Returns ``{future: (name, deadline_at, tag)}`` for ``iter_completed``.
+    ``pages`` can override ``page`` per provider; ``tag`` is passed through
+    untouched so callers can tell several fan-outs apart. ``priority`` decides
+    who gets the last of a provider's rate budget (see ratelimit.py).
+    """
+    pages = pages or {}
+    started = time.monotonic()
+    return {
+        provider_executor.submit(cached_provider_call, name, query, pages.get(name, page), per_page, limit, priority):
+            (name, started + provider_deadline(name), tag)
+        for name, limit in plan.items()
+    }
+
+
+def provider_result(name, future):
+    try:
+        outcome = future.result()
+    except (CircuitOpenError, RateLimitedError) as e:
+        logger.info("%s skipped: %s", name, e)
+        return {'success': False, 'count': 0, 'error': str(e), 'timed_out': False}
+    except Exception as e:
+        logger.warning("%s failed: %s", name, e)
+        return {'success': False, 'count': 0, 'error': str(e), 'timed_out': False}
+
+    logger.debug("%s returned %s images", name, outcome['count'])
+    return {'success': True, 'count': outcome['count'], 'error': None, 'timed_out': False,
+            'images': outcome['images'], 'total_pages': outcome['total_pages']}
+
+
+def iter_completed(calls):
+    """Yield ``((name, deadline_at, tag), result)`` as each provider call finishes.
+
+    Calls still running at their deadline are cancelled and yielded with
+    ``timed_out`` set, so the caller never waits past the latest deadline.
+    """
+    pending = set(calls)
+    while pending:
+        next_deadline = min(calls[future][1] for future in pending)
+        done, _ = wait(pending, timeout=max(next_deadline - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+        for future in done:
+            pending.discard(future)
+            name, deadline_at, _ = calls[future]
+            record_span(f"provider.{name}", time.monotonic() - (deadline_at - provider_deadline(name)))
+            yield calls[future], provider_result(name, future)
+
+        now = time.monotonic()
+        for future in [f for f in pending if calls[f][1] <= now]:
+            pending.discard(future)
+            future.cancel()
+            name = calls[future][0]
+            deadline = provider_deadline(name)
+            logger.warning("%s timed out after %gs", name, deadline)
+            record_span(f"provider.{name}", deadline)
+            yield calls[future], {'success': False, 'count': 0, 'error': f"Timed out after {deadline:g}s", 'timed_out': True}
+
+
+def gather_providers(query, page, per_page, plan, pages=None, priority=PRIORITY_USER):
+    """Query every planned provider concurrently and keep whatever finishes in time.
+
+    Each provider gets its own deadline (``PROVIDER_DEADLINES``), bounded by the
+    overall ``REQUEST_DEADLINE``. Providers that miss their deadline are
+    reported with ``timed_out`` set and contribute no images. ``pages`` can
+    override ``page`` per provider.
+    """
+    calls = submit_providers(query, page, per_page, plan, pages, priority=priority)
+    return {meta[0]: result for meta, result in iter_completed(calls)}
+
+
+def page_summary(query, page, results):
+    """Pagination fields and the ``debug`` block for one /images page."""
+    api_results = {
+        'unsplash': {'success': False, 'count': 0, 'error': None, 'timed_out': False},
+        'pexels': {'success': False, 'count': 0, 'error': None, 'timed_out': False},
+        'nekos': {'success': False, 'count': 0, 'error': None, 'timed_out': False},
+        'artic': {'success': False, 'count': 0, 'error': None, 'timed_out': False}
+    }
+
+    total_pages = 1
+    for name, result in results.items():
+        api_results[name] = {key: result[key] for key in ('success', 'count', 'error', 'timed_out')}
+        if name in ("unsplash", "pexels", "index") and result['success']:
+            total_pages = max(total_pages, result['total_pages'])
+
+    if query:
+        total_pages = min(total_pages, 20)
+    else:
+        total_pages = 50
+
+    return {
+        "current_page": page,
+        "total_pages": total_pages,
+        "has_next": page < total_pages,
+        "has_prev": page > 1,
+        "debug": api_results
+    }
+
+
+def with_thumbnails(images):
+    """Point each record's thumbnail at the /thumb proxy (copies, cached dicts stay untouched)."""
+    return [dict(img, thumbnail=thumb_url(img["thumbnail"])) for img in images]
+
+
+def with_likes(images):
+    """Add locally recorded likes to each record using one batched lookup."""
+    counts = like_store.counts(img["url"] for img in images)
+    return [dict(img, likes=img["likes"] + counts[img["url"]]) for img in images]
+
+
+def collect_images(results):
+    # The local index and a top-up from its source can return the same record.
+    images = {}
+    for result in results.values():
+        for img in result.get('images', []):
+            images.setdefault(img["url"], img)
+    return list(images.values())
+
+
+def mix(images):
+    """Shuffle in place, the same way every time for the same set of images.
+
+    Pages still look random, but an unchanged result set serializes to the
+    same bytes, so its ETag holds and revalidation returns 304.
+    """
+    images.sort(key=lambda img: img["url"])
+    seed = hashlib.blake2b("\n".join(img["url"] for img in images).encode(), digest_size=8).digest()
+    random.Random(seed).shuffle(images)
+
+
+def json_response(payload, cache_control):
+    status, body, headers = encode_json(
+        payload, request.headers.get("Accept-Encoding"), request.headers.get("If-None-Match"), cache_control)
+    return Response(body, status=status, mimetype="application/json", headers=headers)
+
+
+def index_result(query, page, per_page):
+    """One /images page from the local index, as a provider-shaped result (None if it has nothing)."""
+    if not query:
+        return None
+    # Only records from the /images providers; WallpaperFlare has its own pages.
+    images, matches = search_index.search(query, (page - 1) * per_page, per_page, sources=tuple(PROVIDERS))
+    if not images:
+        return None
+    # One page past what the index holds, so scrolling carries on upstream.
+    return {'success': True, 'count': len(images), 'error': None, 'timed_out': False,
+            'images': images, 'total_pages': matches // per_page + 2}
+
+
+def page_args(params):
+    """Validated ``(page, per_page)`` from request parameters; ValueError says what is wrong."""
+    try:
+        page = int(params.get("page", 1))
+        per_page = int(params.get("per_page", 20))
+    except (TypeError, ValueError):
+        raise ValueError("page and per_page must be integers")
+    if page < 1 or not 1 <= per_page <= IMAGES_MAX_PER_PAGE:
+        raise ValueError(f"page must be at least 1 and per_page between 1 and {IMAGES_MAX_PER_PAGE}")
+    return page, per_page
+
+
+def page_plan(query, page, per_page):
+    """The local index's share of one /images page and the provider plan for the rest."""
+    indexed = index_result(query, page, per_page)
+    missing = per_page - (indexed["count"] if indexed else 0)
+    if missing <= 0:
+        return indexed, {}
+    quotas = page_quotas(per_page)
+    if missing < per_page:
+        # Scaled down, rounding up so even a gap of one item is asked for.
+        quotas = {name: math.ceil(limit * missing / per_page) for name, limit in quotas.items()}
+    return indexed, plan_providers(query, quotas)
+
+
+def gather_page(query, page, per_page):
+    """Results for one /images page: the local index first, providers only for what it lacks."""
+    with span("index"):
+        indexed, plan = page_plan(query, page, per_page)
+    results = {"index": indexed} if indexed else {}
+    if plan:
+        with span("gather"):
+            results.update(gather_providers(query, page, per_page, plan, priority=page_priority(page)))
+    return results
+
+
+def wallpaper_search_page(query, page):
+    """WallpaperFlare URLs for /wallpaper/search: the indexed copy of that exact page, else a scrape.
+
+    Pages are never pieced together from index records and a scrape, so page
+    ``p`` always matches WallpaperFlare's own page ``p``.
+    """
+    return search_index.listed_page("wallpaperflare", query, page) or fetch_wallpaperflare_images(query, page)
+
+
+def crawl_query(query, page):
+    """Fetch ``page`` of ``query`` from every remote provider; the results land in the index."""
+    plan = plan_providers(query, internal_quotas(100))
+    plan = {name: limit for name, limit in plan.items() if name not in LOCAL_PROVIDERS}
+    gather_providers(query, page, 100, plan, priority=PRIORITY_BACKGROUND)
+    fetch_wallpaperflare_images(query, page)
+
+def fetch_cursor_round(query, pages):
+    plan = {name: CURSOR_FETCH_SIZES[name] for name in pages}
+    priority = PRIORITY_FIRST_PAGE if all(page == 1 for page in pages.values()) else PRIORITY_USER
+    results = gather_providers(query, 1, CURSOR_FETCH_SIZES["pexels"], plan, pages=pages, priority=priority)
+    return {name: result.get('images') if result['success'] else None for name, result in results.items()}
+
+
+def cursor_providers(query):
+    # Local providers (the neko pool) hand each worker different random items,
+    # which would make the same offset mean different images per worker.
+    return [name for name in plan_providers(query, CURSOR_FETCH_SIZES) if name not in LOCAL_PROVIDERS]
+
+
+search_index = SearchIndex(crawl_query, RANDOM_WALLPAPER_QUERIES)
+wallpaper_pool = WallpaperPool(fetch_wallpaperflare_images, RANDOM_WALLPAPER_QUERIES)
+prefetcher = Prefetcher(warm_page)
+cursor_pager = CursorPager(fetch_cursor_round)
+
 @app.route("/")
 def index():
     return render_template("index.html")
@@ -72,6 +686,38 @@ def image_detail():
         image_likes=image_likes
     )
 
+def attachment_header(filename):
+    ascii_name = filename.encode("ascii", "ignore").decode().replace('"', "") or "downloaded_image.jpg"
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename)}"
+
+def stream_upstream(response, max_bytes=DOWNLOAD_MAX_BYTES, rate_limit=DOWNLOAD_RATE_LIMIT):
+    """Yield the upstream body chunk by chunk in constant memory.
+
+    Past ``max_bytes`` it raises, so the server drops the connection and the
+    client sees an incomplete download rather than a short 200. When
+    ``rate_limit`` (bytes/second) is set it sleeps between chunks so the
+    download never runs faster than that.
+    """
+    sent = 0
+    started = time.monotonic()
+    try:
+        # Raw bytes, so the forwarded Content-Length/Content-Encoding stay truthful.
+        for chunk in response.raw.stream(DOWNLOAD_CHUNK_SIZE, decode_content=False):
+            if not chunk:
+                continue
+            if sent + len(chunk) > max_bytes:
+                logger.warning("download exceeded %s bytes, aborting", max_bytes)
+                raise DownloadTooLargeError(f"download exceeded {max_bytes} bytes")
+            sent += len(chunk)
+            metrics.download_bytes.inc(amount=len(chunk))
+            yield chunk
+            if rate_limit:
+                ahead = sent / rate_limit - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+    finally:
+        response.close()
+
 @app.route("/download_image")
 def download_image():
     image_url = request.args.get("url")
@@ -80,26 +726,118 @@ def download_image():
     if not image_url:
         return "No image URL provided", 400
 
+    # Forward Range/If-Range so resumed downloads only fetch what is missing.
+    upstream_headers = {
+        header: request.headers[header]
+        for header in ("Range", "If-Range")
+        if header in request.headers
+    }
+
+    response = None
     try:
-        response = requests.get(image_url, stream=True, timeout=10)
+        response = http_client.get(image_url, headers=upstream_headers, stream=True, timeout=10)
+        if response.status_code == 416:
+            response.close()
+            return "Requested range not satisfiable", 416
         response.raise_for_status()
 
-        content_type = response.headers.get('Content-Type', 'application/octet-stream')
-        image_data = BytesIO(response.content)
+        content_length = response.headers.get('Content-Length')
+        if content_length and int(content_length) > DOWNLOAD_MAX_BYTES:
+            response.close()
+            return "Image is too large to download", 413
+
+        headers = {
+            "Content-Disposition": attachment_header(filename),
+            "Accept-Ranges": response.headers.get('Accept-Ranges', 'none'),
+        }
+        for header in ("Content-Length", "Content-Range", "Content-Encoding", "ETag", "Last-Modified"):
+            if header in response.headers:
+                headers[header] = response.headers[header]
 
-        return send_file(
-            image_data,
-            mimetype=content_type,
-            as_attachment=True,
-            download_name=filename
+        return Response(
+            stream_upstream(response),
+            status=response.status_code,
+            mimetype=response.headers.get('Content-Type', 'application/octet-stream'),
+            headers=headers,
+            direct_passthrough=True
         )
     except requests.exceptions.RequestException as e:
-        print(f"Error fetching image for download: {e}")
+        if response is not None:
+            response.close()
+        logger.warning("download failed url=%s: %s", image_url, e)
         return f"Error downloading image: {e}", 500
     except Exception as e:
-        print(f"An unexpected error occurred during download: {e}")
+        if response is not None:
+            response.close()
+        logger.exception("unexpected error during download url=%s", image_url)
         return "An unexpected error occurred", 500
 
+@app.route("/download_zip", methods=["POST"])
+def download_zip():
+    """Stream several images as one ZIP archive.
+
+    Takes ``{"urls": [...], "filename": "..."}`` as JSON or the same fields as
+    form values (so a plain form POST triggers a browser download). Images
+    that fail or come from hosts outside the thumbnail allowlist are skipped
+    and listed in the archive's errors.txt.
+    """
+    if request.is_json:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return "Expected a JSON object", 400
+        urls = data.get("urls")
+        filename = data.get("filename")
+        if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+            return "urls must be a list of strings", 400
+        if filename is not None and not isinstance(filename, str):
+            return "filename must be a string", 400
+    else:
+        urls = request.form.getlist("urls")
+        filename = request.form.get("filename")
+
+    urls = [url for url in dict.fromkeys(urls) if url]
+    if not urls:
+        return "No image URLs provided", 400
+    if len(urls) > BULK_MAX_ITEMS:
+        return f"At most {BULK_MAX_ITEMS} images per archive", 413
+
+    filename = filename or "images.zip"
+    if not filename.lower().endswith(".zip"):
+        filename += ".zip"
+    skipped = [(url, "host not allowed") for url in urls if not is_allowed(url)]
+    allowed = [url for url in urls if is_allowed(url)]
+
+    return Response(
+        stream_zip(allowed, skipped),
+        mimetype="application/zip",
+        headers={"Content-Disposition": attachment_header(filename), "Cache-Control": "no-store"},
+        direct_passthrough=True
+    )
+
+@app.route("/thumb")
+def thumbnail():
+    image_url = request.args.get("url")
+    try:
+        width = pick_width(int(request.args.get("w", THUMB_DEFAULT_WIDTH)))
+    except ValueError:
+        return "Invalid width", 400
+
+    if not image_url:
+        return "No image URL provided", 400
+    if not is_allowed(image_url):
+        return "Image host not allowed", 403
+
+    try:
+        path, key = thumbnail_cache.get(image_url, width)
+    except Exception as e:
+        # Fall back to the original so the grid still shows something.
+        logger.warning("thumbnail failed url=%s: %s", image_url, e)
+        return redirect(image_url)
+
+    response = send_file(path, mimetype="image/webp", etag=key, max_age=THUMB_MAX_AGE, conditional=True)
+    response.headers["Cache-Control"] = f"public, max-age={THUMB_MAX_AGE}, immutable"
+    return response
+
 # New route to handle image likes
 @app.route('/like_image', methods=['POST'])
 def like_image():
@@ -109,228 +847,156 @@ def like_image():
     if not image_url:
         return jsonify({'success': False, 'message': 'No image URL provided'}), 400
 
-    # Simulate liking an image. In a real application, you would:
-    # 1. Store likes in a database associated with the image URL or ID.
-    # 2. Increment the like count for that image.
-    # 3. Retrieve the updated like count.
-    
-    # For now, we'll just return a dummy incremented count.
-    # You might want to pass the current like count from the frontend
-    # and increment it here, or fetch it from a dummy store.
-    
-    # Let's assume a base like count and increment it
-    # This is not persistent across server restarts or for multiple users
-    # For a real application, implement a database (e.g., Firestore)
-    
-    # Simulate a successful like
-    current_likes = random.randint(100, 10000) # This will generate a new random number each time
-    new_likes_count = current_likes + 1 
+    # Lists show the provider's own count plus the likes recorded here, and
+    # only this server's part is known, so the client adds the delta to what
+    # it already shows. ``local_likes`` is this server's total for the image.
+    local_likes = like_store.like(image_url)
 
-    return jsonify({'success': True, 'new_likes_count': new_likes_count})
+    return jsonify({'success': True, 'likes_added': 1, 'local_likes': local_likes})
 
 
 @app.route("/images")
 def fetch_images():
     query = request.args.get("query", "")
-    page = int(request.args.get("page", 1))
-    per_page = int(request.args.get("per_page", 20))
+    try:
+        page, per_page = page_args(request.args)
+    except ValueError as e:
+        return jsonify({'images': [], 'error': str(e)}), 400
 
-    print(f"\n🔍 Fetching images - Query: '{query}', Page: {page}")
+    if "cursor" in request.args:
+        return fetch_images_by_cursor(query, per_page, request.args.get("cursor"))
+
+    prefetcher.record_request(query, page, per_page)
+    results = gather_page(query, page, per_page)
+    summary = page_summary(query, page, results)
+
+    # Index records come first, so a top-up that overshoots never pushes them off the page.
+    all_images = collect_images(results)[:per_page]
+    mix(all_images)
+    with span("decorate"):
+        all_images = count_images(with_likes(with_thumbnails(all_images)))
+
+    prefetcher.schedule(query, page, per_page, summary["total_pages"])
+
+    logger.info("images query=%r page=%s served=%s %s", query, page, len(all_images), " ".join(
+        f"{api}={'ok' if result['success'] else ('timeout' if result['timed_out'] else 'fail')}:{result['count']}"
+        for api, result in summary["debug"].items()))
+
+    response_data = {"images": all_images, **summary}
     
-    all_images = []
-    total_pages = 1
-    api_results = {
-        'unsplash': {'success': False, 'count': 0, 'error': None},
-        'pexels': {'success': False, 'count': 0, 'error': None},
-        'nekos': {'success': False, 'count': 0, 'error': None},
-        'artic': {'success': False, 'count': 0, 'error': None}
-    }
- 
-    if UNSPLASH_ACCESS_KEY and UNSPLASH_ACCESS_KEY != "your_unsplash_access_key_here": # Set your unsplash key env not set
-        try:
-            unsplash_params = {
-                "page": page,
-                "per_page": min(per_page // 4, 10),
-                "client_id": UNSPLASH_ACCESS_KEY
-            }
-            
-            if query:
-                unsplash_params["query"] = query
-                unsplash_url = "https://api.unsplash.com/search/photos"
-            else:
-                unsplash_url = "https://api.unsplash.com/photos"
-                
-            print(f"📡 Calling Unsplash API: {unsplash_url}")
-            unsplash = requests.get(unsplash_url, params=unsplash_params, timeout=10)
-            
-            print(f"Unsplash response status: {unsplash.status_code}")
-            
-            if unsplash.ok:
-                data = unsplash.json()
-                results = data.get("results", []) if query else data
-                total_pages = max(total_pages, data.get("total_pages", 1) if query else 50)
-                
-                for img in results[:per_page//4]:
-                    all_images.append({
-                        "url": img["urls"]["regular"],
-                        "thumbnail": img["urls"]["small"],
-                        "source": "unsplash",
-                        "alt": img.get("alt_description", "Unsplash image"),
-                        "author": img["user"]["name"] if "user" in img else "Unknown",
-                        "likes": img.get("likes", 0)
-                    })
-                
-                api_results['unsplash'] = {'success': True, 'count': len(results), 'error': None}
-                print(f"✅ Unsplash: {len(results)} images")
-            else:
-                error_msg = f"Status {unsplash.status_code}: {unsplash.text}"
-                api_results['unsplash']['error'] = error_msg
-                print(f"❌ Unsplash error: {error_msg}")
-                
-        except Exception as e:
-            api_results['unsplash']['error'] = str(e)
-            print(f"❌ Unsplash exception: {e}")
-    else:
-        print("⚠️ Unsplash API key not configured")
+    with span("serialize"):
+        return json_response(response_data, f"public, max-age={IMAGES_MAX_AGE}")
 
-    if PEXELS_API_KEY and PEXELS_API_KEY != "your_pexels_api_key_here": # Set your unsplash key env not set
-        try:
-            headers = {"Authorization": PEXELS_API_KEY}
-            pexels_params = {
-                "per_page": min(per_page // 4, 15),
-                "page": page
-            }
-            
-            if query:
-                pexels_params["query"] = query
-                pexels_url = "https://api.pexels.com/v1/search"
-            else:
-                pexels_url = "https://api.pexels.com/v1/curated"
-                
-            print(f"📡 Calling Pexels API: {pexels_url}")
-            pexels = requests.get(pexels_url, headers=headers, params=pexels_params, timeout=10)
-            
-            print(f"Pexels response status: {pexels.status_code}")
-            
-            if pexels.ok:
-                data = pexels.json()
-                photos = data.get("photos", [])
-                total_pages = max(total_pages, (data.get("total_results", 500) // per_page) + 1)
-                
-                for img in photos[:per_page//4]:
-                    all_images.append({
-                        "url": img["src"]["large"],
-                        "thumbnail": img["src"]["medium"],
-                        "source": "pexels",
-                        "alt": img.get("alt", "Pexels image"),
-                        "author": img.get("photographer", "Unknown"),
-                        "likes": random.randint(50, 5000)
-                    })
-                
-                api_results['pexels'] = {'success': True, 'count': len(photos), 'error': None}
-            else:
-                error_msg = f"Status {pexels.status_code}: {pexels.text}"
-                api_results['pexels']['error'] = error_msg
-                print(f"❌ Pexels error: {error_msg}")
-                
-        except Exception as e:
-            api_results['pexels']['error'] = str(e)
-            print(f"❌ Pexels exception: {e}")
+@app.route("/images/stream", methods=["GET", "POST"])
+def stream_images():
+    """Progressive /images: one frame per provider batch as soon as it arrives.
+
+    GET takes the usual ``query``/``page``/``per_page``. POST takes
+    ``{"requests": [{"query": ..., "page": ..., "per_page": ...}, ...]}`` so
+    several pages can be fetched in one round trip. Frames are NDJSON by
+    default or server-sent events with ``format=sse``. What the local index
+    holds is sent first as provider ``index``. Every request ends with a
+    ``done`` frame carrying its pagination fields and ``debug`` block.
+    """
+    if request.method == "POST":
+        body = request.get_json(silent=True)
+        batch = (body.get("requests") if isinstance(body, dict) else None) or []
     else:
-        print("⚠️ Pexels API key not configured")
+        batch = [request.args]
+    if not isinstance(batch, list) or not batch or len(batch) > STREAM_MAX_REQUESTS:
+        return jsonify({'error': f'Between 1 and {STREAM_MAX_REQUESTS} requests are allowed'}), 400
 
-    if not query or any(word in query.lower() for word in ["anime", "cat", "neko", "cute", "pixel"]):
+    parsed = []
+    for index, item in enumerate(batch):
+        if not isinstance(item, Mapping):
+            return jsonify({'error': f'Request {index} must be an object'}), 400
         try:
-            print("📡 Calling Nekos API")
-            for i in range(min(3, per_page // 8)):
-                neko = requests.get("https://nekos.life/api/v2/img/neko", timeout=10)
-                if neko.ok:
-                    img_data = neko.json()
-                    all_images.append({
-                        "url": img_data["url"],
-                        "thumbnail": img_data["url"],
-                        "source": "nekos",
-                        "alt": "Neko anime image",
-                        "author": "Nekos.life",
-                        "likes": random.randint(10, 1000)
-                    })
-                    
-            api_results['nekos'] = {'success': True, 'count': min(3, per_page // 8), 'error': None}
-            print(f"✅ Nekos: {min(3, per_page // 8)} images")
-        except Exception as e:
-            api_results['nekos']['error'] = str(e)
-            print(f"❌ Nekos exception: {e}")
+            page, per_page = page_args(item)
+        except ValueError as e:
+            return jsonify({'error': f'Request {index}: {e}'}), 400
+        parsed.append((str(item.get("query", "")), page, per_page))
 
-    try:
-        chicago_params = {
-            "limit": min(per_page // 6, 8),
-            "page": page,
-            "fields": "image_id,title,artist_title"
-        }
-        
-        if query:
-            chicago_params["q"] = query
-            chicago_url = "https://api.artic.edu/api/v1/artworks/search"
-        else:
-            chicago_url = "https://api.artic.edu/api/v1/artworks"
-            
-        print(f"📡 Calling Art Institute API: {chicago_url}")
-        chicago = requests.get(chicago_url, params=chicago_params, timeout=10)
-        
-        print(f"Art Institute response status: {chicago.status_code}")
-        
-        if chicago.ok:
-            data = chicago.json()
-            artworks = data.get("data", [])
-            
-            for art in artworks:
-                img_id = art.get("image_id")
-                if img_id:
-                    all_images.append({
-                        "url": f"https://www.artic.edu/iiif/2/{img_id}/full/843,/0/default.jpg",
-                        "thumbnail": f"https://www.artic.edu/iiif/2/{img_id}/full/400,/0/default.jpg",
-                        "source": "artic",
-                        "alt": art.get("title", "Art Institute artwork"),
-                        "author": art.get("artist_title", "Unknown Artist"),
-                        "likes": random.randint(100, 10000)
-                    })
-            
-            api_results['artic'] = {'success': True, 'count': len(artworks), 'error': None}
-            print(f"✅ Art Institute: {len(artworks)} images")
-        else:
-            error_msg = f"Status {chicago.status_code}: {chicago.text}"
-            api_results['artic']['error'] = error_msg
-            print(f"❌ Art Institute error: {error_msg}")
-            
-    except Exception as e:
-        api_results['artic']['error'] = str(e)
-        print(f"❌ Art Institute exception: {e}")
+    jobs = []
+    calls = {}
+    for index, (query, page, per_page) in enumerate(parsed):
+        indexed, plan = page_plan(query, page, per_page)
+        prefetcher.record_request(query, page, per_page)
+        jobs.append({"query": query, "page": page, "per_page": per_page, "sent": 0, "seen": set(),
+                     "results": {"index": indexed} if indexed else {}, "remaining": len(plan)})
+        calls.update(submit_providers(query, page, per_page, plan, tag=index, priority=page_priority(page)))
 
-    random.shuffle(all_images)
-    all_images = all_images[:per_page]
-    
-    if query:
-        total_pages = min(total_pages, 20)
-    else:
-        total_pages = 50
+    sse = request.args.get("format") == "sse"
 
-    print(f"\n📊 SUMMARY:")
-    print(f"Total images collected: {len(all_images)}")
-    for api, result in api_results.items():
-        status = "✅" if result['success'] else "❌"
-        error = f" - {result['error']}" if result['error'] else ""
-        print(f"{status} {api.capitalize()}: {result['count']} images{error}")
+    def frame(payload):
+        data = dumps(payload).decode()
+        if sse:
+            return f"event: {payload['type']}\ndata: {data}\n\n"
+        return data + "\n"
 
-    response_data = {
-        "images": all_images,
-        "current_page": page,
-        "total_pages": total_pages,
-        "has_next": page < total_pages,
-        "has_prev": page > 1,
-        "debug": api_results
-    }
-    
-    return jsonify(response_data)
+    def done_frame(index, job):
+        summary = page_summary(job["query"], job["page"], job["results"])
+        prefetcher.schedule(job["query"], job["page"], job["per_page"], summary["total_pages"])
+        return frame({"type": "done", "request": index, "query": job["query"], **public_payload(summary)})
+
+    def batch_frame(index, job, name, result):
+        # The index holds provider records, so a top-up can repeat one of them.
+        images = [img for img in result.get('images', []) if img["url"] not in job["seen"]]
+        images = images[:job["per_page"] - job["sent"]]
+        if not images:
+            return None
+        job["sent"] += len(images)
+        job["seen"].update(img["url"] for img in images)
+        return frame({"type": "batch", "request": index, "query": job["query"], "page": job["page"],
+                      "provider": name, "images": count_images(with_likes(with_thumbnails(images)))})
+
+    def generate():
+        # Index answers are already here: send them before any provider call returns.
+        for index, job in enumerate(jobs):
+            batch = batch_frame(index, job, "index", job["results"]["index"]) if "index" in job["results"] else None
+            if batch:
+                yield batch
+            if job["remaining"] == 0:
+                yield done_frame(index, job)
+
+        for (name, _, index), result in iter_completed(calls):
+            job = jobs[index]
+            job["results"][name] = result
+            job["remaining"] -= 1
+
+            batch = batch_frame(index, job, name, result)
+            if batch:
+                yield batch
+            if job["remaining"] == 0:
+                yield done_frame(index, job)
+
+    return Response(
+        generate(),
+        mimetype="text/event-stream" if sse else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def fetch_images_by_cursor(query, per_page, cursor):
+    """Cursor variant of /images: ``?cursor=`` starts a feed, ``next_cursor`` continues it."""
+    offset = 0
+    if cursor:
+        try:
+            query, offset = decode_cursor(cursor)
+        except InvalidCursor as e:
+            return jsonify({'images': [], 'error': str(e)}), 400
+
+    with span("buffer"):
+        images, next_cursor, buffered = cursor_pager.page(
+            query, offset, per_page, cursor_providers(query), REQUEST_DEADLINE)
+    images = count_images(with_likes(with_thumbnails(images)))
+    logger.info("images query=%r offset=%s served=%s buffered=%s", query, offset, len(images), buffered)
+
+    return json_response({
+        "images": images,
+        "query": query,
+        "next_cursor": next_cursor,
+        "has_next": next_cursor is not None,
+        "debug": {"buffered": buffered, "offset": offset}
+    }, f"public, max-age={IMAGES_MAX_AGE}")
 
 @app.route('/wallpaper')
 def wallpaper_page():
@@ -338,14 +1004,22 @@ def wallpaper_page():
 
 @app.route('/wallpaper/random')
 def get_random_wallpapers():
-    random_query = random.choice(RANDOM_WALLPAPER_QUERIES)
-    images = fetch_wallpaperflare_images(random_query, 1)
-    return jsonify({
+    pooled = wallpaper_pool.random_page()
+    if pooled:
+        random_query, page, images = pooled
+    else:
+        # Only until the pool's first scrapes land, seconds after the first request.
+        random_query, page = random.choice(RANDOM_WALLPAPER_QUERIES), 1
+        images = fetch_wallpaperflare_images(random_query, page)
+    images = count_images(images)
+    # Each click should get a new draw, so browsers must not keep it.
+    return json_response({
         'images': images, 
+        'thumbnails': [thumb_url(img_url) for img_url in images],
         'query': random_query, 
-        'page': 1,
+        'page': page,
         'is_random': True
-    })
+    }, "no-store")
 
 @app.route('/wallpaper/search')
 def search_wallpapers():
@@ -355,13 +1029,14 @@ def search_wallpapers():
     if not query:
         return jsonify({'images': [], 'error': 'No query provided'})
     
-    images = fetch_wallpaperflare_images(query, page)
-    return jsonify({
+    images = count_images(wallpaper_search_page(query, page))
+    return json_response({
         'images': images, 
+        'thumbnails': [thumb_url(img_url) for img_url in images],
         'query': query, 
         'page': page,
         'is_random': False
-    })
+    }, f"public, max-age={WALLPAPER_MAX_AGE}")
 
 @app.route('/related_images')
 def get_related_images():
@@ -375,142 +1050,45 @@ def get_related_images():
     if source == 'wallpaperflare':
         if not query:
             query = random.choice(RANDOM_WALLPAPER_QUERIES)
-        related_images = fetch_wallpaperflare_images(query, page)
-        related_images = [{
-            "url": img_url,
-            "thumbnail": img_url,
-            "source": "wallpaperflare",
-            "alt": query,
-            "author": "WallpaperFlare",
-            "likes": random.randint(100, 10000)
-        } for img_url in related_images[:per_page]]
+        related_images = fetch_wallpaperflare_images(query, page, limit=per_page)
+        related_images = with_likes(with_thumbnails(wallpaperflare_records(query, related_images[:per_page])))
 
-    else:
-        temp_response = fetch_images_internal(query=query, page=page, per_page=per_page * 2)
-        
-        related_images = [img for img in temp_response['images'] if img['source'] == source][:per_page]
+    elif source in PROVIDERS and provider_enabled(source):
+        related_images, exhausted = fetch_source_images(source, query, page, per_page)
+
+        # Only go to the other providers once the requested one has nothing more.
+        missing = per_page - len(related_images)
+        if missing > 0 and exhausted:
+            plan = plan_providers(query, internal_quotas(missing))
+            plan.pop(source, None)
+            others = collect_images(gather_providers(query, page, missing, plan, priority=PRIORITY_BACKGROUND))
+            mix(others)
+            related_images += others[:missing]
 
-        if not related_images and query:
-             temp_response = fetch_images_internal(query=query, page=page, per_page=per_page)
-             related_images = temp_response['images'][:per_page]
+        related_images = with_likes(with_thumbnails(related_images))
 
+    else:
+        temp_response = fetch_images_internal(query=query, page=page, per_page=per_page, priority=PRIORITY_BACKGROUND)
+        related_images = temp_response['images'][:per_page]
 
-    return jsonify({
-        "images": related_images,
+    return json_response({
+        "images": count_images(related_images),
         "query": query,
         "source": source
-    })
+    }, f"public, max-age={IMAGES_MAX_AGE}")
 
-def fetch_images_internal(query="", page=1, per_page=20):
-    all_images = []
-    total_pages = 1
-    
-    if UNSPLASH_ACCESS_KEY and UNSPLASH_ACCESS_KEY != "your_unsplash_access_key_here":
-        try:
-            unsplash_params = {
-                "page": page,
-                "per_page": min(per_page // 2, 50),
-                "client_id": UNSPLASH_ACCESS_KEY
-            }
-            if query:
-                unsplash_params["query"] = query
-                unsplash_url = "https://api.unsplash.com/search/photos"
-            else:
-                unsplash_url = "https://api.unsplash.com/photos"
-            unsplash = requests.get(unsplash_url, params=unsplash_params, timeout=10)
-            if unsplash.ok:
-                data = unsplash.json()
-                results = data.get("results", []) if query else data
-                total_pages = max(total_pages, data.get("total_pages", 1) if query else 50)
-                for img in results[:per_page//2]:
-                    all_images.append({
-                        "url": img["urls"]["regular"],
-                        "thumbnail": img["urls"]["small"],
-                        "source": "unsplash",
-                        "alt": img.get("alt_description", "Unsplash image"),
-                        "author": img["user"]["name"] if "user" in img else "Unknown",
-                        "likes": img.get("likes", 0)
-                    })
-        except Exception as e:
-            print(f"❌ Unsplash exception in internal fetch: {e}")
+def fetch_images_internal(query="", page=1, per_page=20, priority=PRIORITY_USER):
+    plan = plan_providers(query, internal_quotas(per_page))
+    results = gather_providers(query, page, per_page, plan, priority=priority)
 
-    if PEXELS_API_KEY and PEXELS_API_KEY != "your_pexels_api_key_here":
-        try:
-            headers = {"Authorization": PEXELS_API_KEY}
-            pexels_params = {
-                "per_page": min(per_page // 2, 50),
-                "page": page
-            }
-            if query:
-                pexels_params["query"] = query
-                pexels_url = "https://api.pexels.com/v1/search"
-            else:
-                pexels_url = "https://api.pexels.com/v1/curated"
-            pexels = requests.get(pexels_url, headers=headers, params=pexels_params, timeout=10)
-            if pexels.ok:
-                data = pexels.json()
-                photos = data.get("photos", [])
-                total_pages = max(total_pages, (data.get("total_results", 500) // per_page) + 1)
-                for img in photos[:per_page//2]:
-                    all_images.append({
-                        "url": img["src"]["large"],
-                        "thumbnail": img["src"]["medium"],
-                        "source": "pexels",
-                        "alt": img.get("alt", "Pexels image"),
-                        "author": img.get("photographer", "Unknown"),
-                        "likes": random.randint(50, 5000)
-                    })
-        except Exception as e:
-            print(f"❌ Pexels exception in internal fetch: {e}")
-
-    if not query or any(word in query.lower() for word in ["anime", "cat", "neko", "cute", "pixel"]):
-        try:
-            for i in range(min(per_page // 4, 25)):
-                neko = requests.get("https://nekos.life/api/v2/img/neko", timeout=10)
-                if neko.ok:
-                    img_data = neko.json()
-                    all_images.append({
-                        "url": img_data["url"],
-                        "thumbnail": img_data["url"],
-                        "source": "nekos",
-                        "alt": "Neko anime image",
-                        "author": "Nekos.life",
-                        "likes": random.randint(10, 1000)
-                    })
-        except Exception as e:
-            print(f"❌ Nekos exception in internal fetch: {e}")
-
-    try:
-        chicago_params = {
-            "limit": min(per_page // 4, 25),
-            "page": page,
-            "fields": "image_id,title,artist_title"
-        }
-        if query:
-            chicago_params["q"] = query
-            chicago_url = "https://api.artic.edu/api/v1/artworks/search"
-        else:
-            chicago_url = "https://api.artic.edu/api/v1/artworks"
-        chicago = requests.get(chicago_url, params=chicago_params, timeout=10)
-        if chicago.ok:
-            data = chicago.json()
-            artworks = data.get("data", [])
-            for art in artworks:
-                img_id = art.get("image_id")
-                if img_id:
-                    all_images.append({
-                        "url": f"https://www.artic.edu/iiif/2/{img_id}/full/843,/0/default.jpg",
-                        "thumbnail": f"https://www.artic.edu/iiif/2/{img_id}/full/400,/0/default.jpg",
-                        "source": "artic",
-                        "alt": art.get("title", "Art Institute artwork"),
-                        "author": art.get("artist_title", "Unknown Artist"),
-                        "likes": random.randint(100, 10000)
-                    })
-    except Exception as e:
-        print(f"❌ Art Institute exception in internal fetch: {e}")
+    total_pages = 1
+    for name in ("unsplash", "pexels"):
+        if results.get(name, {}).get('success'):
+            total_pages = max(total_pages, results[name]['total_pages'])
 
-    random.shuffle(all_images)
-    all_images = all_images[:per_page]
+    all_images = collect_images(results)
+    mix(all_images)
+    all_images = with_likes(with_thumbnails(all_images[:per_page]))
     
     if query:
         total_pages = min(total_pages, 20)
@@ -525,13 +1103,85 @@ def fetch_images_internal(query="", page=1, per_page=20):
         "has_prev": page > 1,
     }
 
+@app.route("/cache_stats")
+def cache_stats():
+    """Hit/miss counters for the provider response cache"""
+    stats = response_cache.stats()
+    stats["prefetch"] = prefetcher.stats()
+    stats["cursors"] = cursor_pager.stats()
+    stats["index"] = search_index.stats()
+    return jsonify(stats)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.profile_token = None
+    if metrics.PROFILE_REQUESTS and (request.args.get("profile") == "1" or request.headers.get("X-Profile") == "1"):
+        g.profile_token = metrics.current_profile.set(metrics.Profile())
+
+@app.after_request
+def finish_request_timer(response):
+    profile = metrics.current_profile.get()
+    if g.get("profile_token") is not None and profile is not None:
+        timing = profile.server_timing()
+        response.headers["Server-Timing"] = timing
+        logger.info("profile %s %s", request.path, timing)
+    return response
+
+@app.teardown_request
+def record_request_latency(_):
+    started = g.pop("request_started", None)
+    if started is not None:
+        # Streamed responses are timed up to their headers.
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.request_latency.observe(time.perf_counter() - started, route)
+    token = g.pop("profile_token", None)
+    if token is not None:
+        metrics.current_profile.reset(token)
+
+@metrics.registry.collector
+def component_gauges():
+    """Numeric fields of every component's stats() as pixerest_<component>_<field> gauges."""
+    components = {
+        "cache": response_cache.stats(),
+        "prefetch": prefetcher.stats(),
+        "cursors": cursor_pager.stats(),
+        "neko_pool": neko_pool.stats(),
+        "thumbnails": thumbnail_cache.stats(),
+        "likes": like_store.stats(),
+        "index": search_index.stats(),
+        "wallpaper_pool": wallpaper_pool.stats(),
+    }
+    gauges = []
+    for component, stats in components.items():
+        for field, value in stats.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                gauges.append((f"pixerest_{component}_{field}", f"{component} {field}", (), [((), value)]))
+    return gauges
+
+@metrics.registry.collector
+def provider_gauges():
+    breakers = provider_health.snapshot()
+    buckets = rate_limiter.snapshot()
+    return [
+        ("pixerest_breaker_open", "1 while a provider's circuit is not closed.", ("provider",),
+         [((name, ), int(state["state"] != CLOSED)) for name, state in breakers.items()]),
+        ("pixerest_rate_tokens", "Tokens left in a provider's rate budget.", ("provider",),
+         [((name, ), bucket["tokens"]) for name, bucket in buckets.items()]),
+    ]
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Process metrics in the Prometheus text format"""
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
 @app.route("/test")
 def test_apis():
     """Test endpoint to check API connectivity"""
     results = {}
     
     try:
-        neko = requests.get("https://nekos.life/api/v2/img/neko", timeout=5)
+        neko = http_client.get("https://nekos.life/api/v2/img/neko", timeout=5)
         results['nekos'] = {
             'status': neko.status_code,
             'working': neko.ok,
@@ -541,7 +1191,7 @@ def test_apis():
         results['nekos'] = {'status': 'error', 'working': False, 'error': str(e)}
     
     try:
-        art = requests.get("https://api.artic.edu/api/v1/artworks?limit=1&fields=image_id,title", timeout=5)
+        art = http_client.get("https://api.artic.edu/api/v1/artworks?limit=1&fields=image_id,title", timeout=5)
         results['artic'] = {
             'status': art.status_code,
             'working': art.ok,
@@ -550,9 +1200,15 @@ def test_apis():
     except Exception as e:
         results['artic'] = {'status': 'error', 'working': False, 'error': str(e)}
     
+    results['breakers'] = provider_health.snapshot()
+    results['rate_limits'] = rate_limiter.snapshot()
+    results['neko_pool'] = neko_pool.stats()
+    results['wallpaper_pool'] = wallpaper_pool.stats()
+    results['thumbnails'] = thumbnail_cache.stats()
+    results['likes'] = like_store.stats()
+
     return jsonify(results)
 
 if __name__ == "__main__":
-    print("🚀 Starting Flask app with debug logging...")
-    print("📝 Visit http://localhost:5000/test to check API connectivity")
+    logger.info("starting Flask app, visit http://localhost:5000/test to check API connectivity")
     app.run(debug=True)
@@ -0,0 +1,399 @@
+"""Async serving mode.
+
+The I/O-bound routes (/images, /related_images, /wallpaper/random,
+/wallpaper/search, /download_image) are served by async views on an httpx
+client, so one process can hold hundreds of upstream waits at once. Every
+other route (templates, /thumb, /like_image, cursor and streaming /images, ...)
+falls through to the unchanged Flask app.
+
+Both modes can run side by side for comparison:
+
+    gunicorn app:app --threads 8 --bind 127.0.0.1:8000     # sync mode
+    uvicorn asgi:app --workers 2 --port 8001               # async mode
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import parse_qs
+
+import httpx
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import app as pixerest
+import http_client
+import metrics
+from cache import response_cache
+from extractors import FigureImageExtractor
+from health import CircuitOpenError, provider_health
+from metrics import count_images
+from responses import encode_json
+from ratelimit import PRIORITY_BACKGROUND, PRIORITY_USER, RateLimitedError, rate_limiter
+
+logger = logging.getLogger(__name__)
+
+
+ASYNC_MAX_CONNECTIONS = int(os.environ.get("ASYNC_MAX_CONNECTIONS", 200))
+# Threads a2wsgi uses for the Flask routes that stay synchronous.
+ASYNC_WSGI_WORKERS = int(os.environ.get("ASYNC_WSGI_WORKERS", 16))
+
+client = None
+
+
+def build_client():
+    transport = httpx.AsyncHTTPTransport(
+        retries=http_client.HTTP_RETRIES,
+        limits=httpx.Limits(
+            max_connections=ASYNC_MAX_CONNECTIONS,
+            max_keepalive_connections=http_client.HTTP_POOL_MAXSIZE,
+        ),
+    )
+    return httpx.AsyncClient(transport=transport, follow_redirects=True, timeout=10)
+
+
+@asynccontextmanager
+async def lifespan(_):
+    global client
+    client = build_client()
+    try:
+        yield
+    finally:
+        await client.aclose()
+
+
+async def call_json_provider(name, query, page, per_page, limit):
+    label, build_request, parse = pixerest.JSON_PROVIDERS[name]
+    url, params, headers = build_request(query, page, per_page, limit)
+
+    with metrics.provider_latency.time(name):
+        response = await client.get(url, params=params, headers=headers, timeout=pixerest.provider_deadline(name))
+    metrics.upstream_responses.inc(name, str(response.status_code))
+    rate_limiter.observe(name, response.status_code, response.headers)
+    if response.status_code >= 400:
+        raise pixerest.ProviderError(f"Status {response.status_code}: {response.text[:200]}")
+
+    return parse(response.json(), query, per_page, limit)
+
+
+async def cached_provider_call(name, query, page, per_page, limit, priority=PRIORITY_USER):
+    if name in pixerest.LOCAL_PROVIDERS:
+        return pixerest.PROVIDERS[name](query, page, per_page, limit)
+    key = pixerest.cache_key(name, query, page, f"{limit}/{per_page}")
+
+    async def fetch():
+        rate_limiter.acquire(name, priority)
+        try:
+            result = await provider_health.acall(
+                name, lambda: call_json_provider(name, query, page, per_page, limit), pixerest.provider_deadline(name))
+        except CircuitOpenError:
+            rate_limiter.refund(name)
+            raise
+        pixerest.search_index.harvest(query, result["images"])
+        return result
+
+    try:
+        return await response_cache.aget_or_fetch(key, fetch)
+    except RateLimitedError:
+        stale = await run_in_threadpool(response_cache.peek, key)
+        if stale is None:
+            raise
+        return stale
+
+
+async def gather_providers(query, page, per_page, plan, priority=PRIORITY_USER):
+    """Async twin of ``app.gather_providers`` with the same result shape."""
+
+    async def run(name, limit):
+        deadline = pixerest.provider_deadline(name)
+        try:
+            # Shielded so a late provider still lands in the cache for next time.
+            outcome = await asyncio.wait_for(
+                asyncio.shield(cached_provider_call(name, query, page, per_page, limit, priority)), deadline)
+        except asyncio.TimeoutError:
+            return name, {'success': False, 'count': 0, 'error': f"Timed out after {deadline:g}s", 'timed_out': True}
+        except (CircuitOpenError, RateLimitedError) as e:
+            return name, {'success': False, 'count': 0, 'error': str(e), 'timed_out': False}
+        except Exception as e:
+            logger.warning("%s failed: %s", name, e)
+            return name, {'success': False, 'count': 0, 'error': str(e), 'timed_out': False}
+        return name, {'success': True, 'count': outcome['count'], 'error': None, 'timed_out': False,
+                      'images': outcome['images'], 'total_pages': outcome['total_pages']}
+
+    return dict(await asyncio.gather(*(run(name, limit) for name, limit in plan.items())))
+
+
+async def scrape_wallpaperflare(query, page=1, limit=None):
+    extractor = FigureImageExtractor(limit)
+    url = pixerest.wallpaperflare_url(query, page)
+    with metrics.provider_latency.time("wallpaperflare"):
+        async with client.stream("GET", url, headers=pixerest.WALLPAPERFLARE_HEADERS, timeout=10) as response:
+            metrics.upstream_responses.inc("wallpaperflare", str(response.status_code))
+            if response.status_code != 200:
+                raise pixerest.ProviderError(f"Failed to load WallpaperFlare page: {response.status_code}")
+            async for chunk in response.aiter_bytes(16384):
+                if extractor.feed(chunk):
+                    break
+    return extractor.close()
+
+
+async def fetch_wallpaperflare_images(query, page=1, limit=None):
+    async def fetch():
+        urls = await provider_health.acall("wallpaperflare", lambda: scrape_wallpaperflare(query, page, limit), 10)
+        pixerest.search_index.harvest(query, pixerest.wallpaperflare_records(query, urls), page if limit is None else None)
+        return urls
+
+    try:
+        key = pixerest.cache_key("wallpaperflare", query, page, limit or 0)
+        return await response_cache.aget_or_fetch(key, fetch)
+    except Exception as e:
+        logger.warning("wallpaperflare fetch failed query=%r page=%s: %s", query, page, e)
+        return []
+
+
+async def fetch_source_images(source, query, page, per_page):
+    """Async twin of ``app.fetch_source_images``."""
+    page_size = min(per_page, pixerest.PROVIDER_PAGE_SIZES[source])
+    started = time.monotonic()
+    images = []
+    seen = set()
+    first_page = (max(page, 1) - 1) * pixerest.RELATED_MAX_PAGES + 1
+
+    for source_page in range(first_page, first_page + pixerest.RELATED_MAX_PAGES):
+        if time.monotonic() - started > pixerest.REQUEST_DEADLINE:
+            return images, False
+        try:
+            result = await cached_provider_call(source, query, source_page, page_size, page_size, PRIORITY_BACKGROUND)
+        except Exception as e:
+            logger.warning("%s failed in related fetch: %s", source, e)
+            return images, True
+
+        for img in result["images"]:
+            if img["url"] not in seen:
+                seen.add(img["url"])
+                images.append(img)
+        if len(images) >= per_page:
+            return images[:per_page], False
+        if result["count"] < page_size:
+            return images, True
+
+    return images, False
+
+
+async def with_likes(images):
+    # Like counts are read from SQLite; keep that off the event loop.
+    return await run_in_threadpool(pixerest.with_likes, images)
+
+
+def json_response(request, payload, cache_control):
+    status, body, headers = encode_json(
+        payload, request.headers.get("Accept-Encoding"), request.headers.get("If-None-Match"), cache_control)
+    return Response(body, status_code=status, media_type="application/json", headers=headers)
+
+
+async def gather_page(query, page, per_page):
+    """Async twin of ``app.gather_page``."""
+    indexed, plan = await run_in_threadpool(pixerest.page_plan, query, page, per_page)
+    results = {"index": indexed} if indexed else {}
+    if plan:
+        results.update(await gather_providers(query, page, per_page, plan, pixerest.page_priority(page)))
+    return results
+
+
+async def wallpaper_search_page(query, page):
+    """Async twin of ``app.wallpaper_search_page``."""
+    urls = await run_in_threadpool(pixerest.search_index.listed_page, "wallpaperflare", query, page)
+    return urls or await fetch_wallpaperflare_images(query, page)
+
+
+async def images(request):
+    query = request.query_params.get("query", "")
+    try:
+        page, per_page = pixerest.page_args(request.query_params)
+    except ValueError as e:
+        return JSONResponse({'images': [], 'error': str(e)}, 400)
+
+    pixerest.prefetcher.record_request(query, page, per_page)
+    results = await gather_page(query, page, per_page)
+    summary = pixerest.page_summary(query, page, results)
+
+    all_images = pixerest.collect_images(results)[:per_page]
+    pixerest.mix(all_images)
+    all_images = count_images(await with_likes(pixerest.with_thumbnails(all_images)))
+
+    pixerest.prefetcher.schedule(query, page, per_page, summary["total_pages"])
+
+    return json_response(request, {"images": all_images, **summary}, f"public, max-age={pixerest.IMAGES_MAX_AGE}")
+
+
+async def random_wallpapers(request):
+    pooled = pixerest.wallpaper_pool.random_page()
+    if pooled:
+        random_query, page, found = pooled
+    else:
+        random_query, page = random.choice(pixerest.RANDOM_WALLPAPER_QUERIES), 1
+        found = await fetch_wallpaperflare_images(random_query, page)
+    found = count_images(found)
+    return json_response(request, {
+        'images': found,
+        'thumbnails': [pixerest.thumb_url(img_url) for img_url in found],
+        'query': random_query,
+        'page': page,
+        'is_random': True
+    }, "no-store")
+
+
+async def search_wallpapers(request):
+    query = request.query_params.get('query', '')
+    page = int(request.query_params.get('page', 1))
+
+    if not query:
+        return JSONResponse({'images': [], 'error': 'No query provided'})
+
+    found = count_images(await wallpaper_search_page(query, page))
+    return json_response(request, {
+        'images': found,
+        'thumbnails': [pixerest.thumb_url(img_url) for img_url in found],
+        'query': query,
+        'page': page,
+        'is_random': False
+    }, f"public, max-age={pixerest.WALLPAPER_MAX_AGE}")
+
+
+async def related_images(request):
+    source = request.query_params.get('source', 'unsplash')
+    query = request.query_params.get('query', '')
+    page = int(request.query_params.get('page', 1))
+    per_page = 100
+
+    if source == 'wallpaperflare':
+        if not query:
+            query = random.choice(pixerest.RANDOM_WALLPAPER_QUERIES)
+        found = await fetch_wallpaperflare_images(query, page, limit=per_page)
+        related = await with_likes(pixerest.with_thumbnails(pixerest.wallpaperflare_records(query, found[:per_page])))
+
+    else:
+        related = []
+        exhausted = True
+        if source in pixerest.PROVIDERS and pixerest.provider_enabled(source):
+            related, exhausted = await fetch_source_images(source, query, page, per_page)
+
+        # Only go to the other providers once the requested one has nothing more.
+        missing = per_page - len(related)
+        if missing > 0 and exhausted:
+            plan = pixerest.plan_providers(query, pixerest.internal_quotas(missing))
+            plan.pop(source, None)
+            others = pixerest.collect_images(await gather_providers(query, page, missing, plan, PRIORITY_BACKGROUND))
+            pixerest.mix(others)
+            related += others[:missing]
+
+        related = await with_likes(pixerest.with_thumbnails(related))
+
+    return json_response(request, {
+        "images": count_images(related),
+        "query": query,
+        "source": source
+    }, f"public, max-age={pixerest.IMAGES_MAX_AGE}")
+
+
+async def download_image(request):
+    image_url = request.query_params.get("url")
+    filename = request.query_params.get("filename", "downloaded_image.jpg")
+
+    if not image_url:
+        return PlainTextResponse("No image URL provided", 400)
+
+    upstream_headers = {
+        header: request.headers[header]
+        for header in ("Range", "If-Range")
+        if header in request.headers
+    }
+
+    try:
+        upstream = await client.send(client.build_request("GET", image_url, headers=upstream_headers), stream=True)
+    except httpx.HTTPError as e:
+        logger.warning("download failed url=%s: %s", image_url, e)
+        return PlainTextResponse(f"Error downloading image: {e}", 500)
+
+    if upstream.status_code == 416:
+        await upstream.aclose()
+        return PlainTextResponse("Requested range not satisfiable", 416)
+    if upstream.status_code >= 400:
+        await upstream.aclose()
+        return PlainTextResponse(f"Error downloading image: status {upstream.status_code}", 500)
+
+    content_length = upstream.headers.get('Content-Length')
+    if content_length and int(content_length) > pixerest.DOWNLOAD_MAX_BYTES:
+        await upstream.aclose()
+        return PlainTextResponse("Image is too large to download", 413)
+
+    headers = {
+        "Content-Disposition": pixerest.attachment_header(filename),
+        "Accept-Ranges": upstream.headers.get('Accept-Ranges', 'none'),
+    }
+    for header in ("Content-Length", "Content-Range", "Content-Encoding", "ETag", "Last-Modified"):
+        if header in upstream.headers:
+            headers[header] = upstream.headers[header]
+
+    async def body():
+        sent = 0
+        started = time.monotonic()
+        try:
+            # Raw bytes, so Content-Length/Content-Encoding stay truthful.
+            async for chunk in upstream.aiter_raw(pixerest.DOWNLOAD_CHUNK_SIZE):
+                if sent + len(chunk) > pixerest.DOWNLOAD_MAX_BYTES:
+                    # Raising (not returning) makes the server drop the connection mid-body.
+                    logger.warning("download exceeded %s bytes, aborting", pixerest.DOWNLOAD_MAX_BYTES)
+                    raise pixerest.DownloadTooLargeError(f"download exceeded {pixerest.DOWNLOAD_MAX_BYTES} bytes")
+                sent += len(chunk)
+                metrics.download_bytes.inc(amount=len(chunk))
+                yield chunk
+                if pixerest.DOWNLOAD_RATE_LIMIT:
+                    ahead = sent / pixerest.DOWNLOAD_RATE_LIMIT - (time.monotonic() - started)
+                    if ahead > 0:
+                        await asyncio.sleep(ahead)
+        finally:
+            await upstream.aclose()
+
+    return StreamingResponse(
+        body(),
+        status_code=upstream.status_code,
+        media_type=upstream.headers.get('Content-Type', 'application/octet-stream'),
+        headers=headers
+    )
+
+
+async_app = Starlette(
+    routes=[
+        Route("/images", images),
+        Route("/related_images", related_images),
+        Route("/wallpaper/random", random_wallpapers),
+        Route("/wallpaper/search", search_wallpapers),
+        Route("/download_image", download_image),
+    ],
+    lifespan=lifespan,
+)
+ASYNC_PATHS = {route.path for route in async_app.routes}
+
+wsgi_app = WSGIMiddleware(pixerest.app, workers=ASYNC_WSGI_WORKERS)
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await async_app(scope, receive, send)
+        return
+
+    path = scope.get("path", "")
+    query = parse_qs(scope.get("query_string", b"").decode(), keep_blank_values=True)
+    # Cursor paging keeps its server-side buffers in the Flask app.
+    if scope["type"] == "http" and path in ASYNC_PATHS and "cursor" not in query:
+        # The Flask routes time themselves; the async ones are timed here.
+        with metrics.request_latency.time(path):
+            await async_app(scope, receive, send)
+    else:
+        await wsgi_app(scope, receive, send)
@@ -0,0 +1,77 @@
+"""Compare the streaming lxml extractor with the old BeautifulSoup path.
+
+Runs both extractors over every saved page in bench/fixtures/wallpaperflare_*.html
+and prints time per scrape and peak Python-heap memory (tracemalloc). libxml2
+allocates outside the Python heap, so the lxml figure understates its total;
+compare worker RSS for absolute numbers.
+
+The bundled fixture is a synthetic page shaped like a WallpaperFlare search
+result (same <li><figure><a><img data-src> layout, surrounding nav, styles and
+scripts). Drop real saved pages next to it to benchmark against them too.
+
+    python bench/bench_extract.py [--iterations 200] [--limit 24]
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from extractors import extract_figure_images, extract_figure_images_bs4
+
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "wallpaperflare_*.html")
+CHUNK_SIZE = 16384
+
+
+def chunked(data):
+    return [data[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE)]
+
+
+def measure(fn, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    elapsed = (time.perf_counter() - started) / iterations
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=None, help="stop the streaming extractor after N results")
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(FIXTURES))
+    if not paths:
+        sys.exit(f"No fixtures found at {FIXTURES}")
+
+    print(f"{'page':<32} {'extractor':<12} {'results':>7} {'ms/scrape':>10} {'peak KiB':>9}")
+    for path in paths:
+        with open(path, "rb") as f:
+            raw = f.read()
+        chunks = chunked(raw)
+
+        runs = {
+            "bs4": lambda: extract_figure_images_bs4(raw.decode("utf-8")),
+            "lxml-stream": lambda: extract_figure_images(chunks, args.limit),
+        }
+        baseline = None
+        for name, fn in runs.items():
+            results = len(fn())
+            elapsed, peak = measure(fn, args.iterations)
+            baseline = baseline or elapsed
+            print(f"{os.path.basename(path):<32} {name:<12} {results:>7} {elapsed * 1000:>10.2f} {peak / 1024:>9.0f}"
+                  + ("" if name == "bs4" else f"   ({baseline / elapsed:.1f}x faster)"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""Drive the app against local provider stand-ins and report throughput and latency.
+
+Starts bench/stubs.py and the app (gunicorn for --mode sync, uvicorn for
+--mode async) as subprocesses on free ports, then runs every scenario at each
+concurrency level as a closed loop: N client threads send requests back to
+back for --duration seconds. For each run it prints requests/second, error
+count, p50/p95/p99 latency and the app's total RSS (master plus workers, read
+from /proc, so Linux only).
+
+    python bench/load_test.py --concurrency 1,8,32 --duration 10
+    python bench/load_test.py --mode async --workers 2 --scenarios images,download
+    python bench/load_test.py --latency 200 --error-rate 0.05 --slow artic=1500 --json before.json
+
+--queries sets how many distinct search terms the scenarios draw from; raise
+it to push the response cache towards misses. --env KEY=VALUE passes settings
+(CACHE_TTL, PROVIDER_WORKERS, ...) through to the app.
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from stubs import add_stub_arguments, provider_env
+
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+STUBS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stubs.py")
+
+QUERY_WORDS = [
+    "nature", "abstract", "space", "city", "ocean", "mountain", "sunset", "forest", "anime", "cars",
+    "technology", "art", "landscape", "minimalist", "dark", "colorful", "fantasy", "architecture",
+    "flowers", "animals", "cat", "winter", "rain", "desert", "bridge", "night", "neon", "autumn",
+]
+
+
+def query_pool(size):
+    return [QUERY_WORDS[i % len(QUERY_WORDS)] + (f" {i // len(QUERY_WORDS)}" if i >= len(QUERY_WORDS) else "")
+            for i in range(size)]
+
+
+# Each scenario turns a random generator into (path, params) for one request.
+def images_request(rng, queries, stub_base):
+    return "/images", {"query": rng.choice(queries + [""]), "page": rng.randint(1, 3), "per_page": 20}
+
+
+def related_request(rng, queries, stub_base):
+    source = rng.choice(["unsplash", "pexels", "artic", "wallpaperflare"])
+    return "/related_images", {"source": source, "query": rng.choice(queries), "page": 1}
+
+
+def wallpaper_search_request(rng, queries, stub_base):
+    return "/wallpaper/search", {"query": rng.choice(queries), "page": rng.randint(1, 3)}
+
+
+def download_request(rng, queries, stub_base):
+    name = f"{rng.randint(0, 99)}.jpg"
+    return "/download_image", {"url": f"{stub_base}/files/{name}", "filename": name}
+
+
+SCENARIOS = {
+    "images": images_request,
+    "related": related_request,
+    "wallpaper_search": wallpaper_search_request,
+    "download": download_request,
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(url, timeout=1).status_code < 500:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def process_tree_rss(pid):
+    """Resident memory in bytes of ``pid`` and all of its descendants."""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pending.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+    return total
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def run_load(base, scenario, queries, stub_base, concurrency, duration, seed):
+    """Closed loop: ``concurrency`` threads send requests back to back for ``duration`` seconds."""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        session = requests.Session()
+        local_latencies = []
+        local_errors = 0
+        while time.monotonic() < stop_at:
+            path, params = scenario(rng, queries, stub_base)
+            started = time.perf_counter()
+            try:
+                response = session.get(base + path, params=params, timeout=30)
+                response.content
+                ok = response.status_code < 400
+            except requests.RequestException:
+                ok = False
+            local_latencies.append(time.perf_counter() - started)
+            local_errors += not ok
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def start_app(args, port, env, workdir):
+    if args.mode == "async":
+        command = [sys.executable, "-m", "uvicorn", "asgi:app", "--app-dir", ROOT,
+                   "--host", "127.0.0.1", "--port", str(port), "--workers", str(args.workers),
+                   "--log-level", "warning"]
+    else:
+        command = [sys.executable, "-m", "gunicorn", "app:app", "--bind", f"127.0.0.1:{port}",
+                   "--workers", str(args.workers), "--threads", str(args.threads), "--log-level", "warning"]
+    # Run from a scratch directory so likes/thumbnail/cache files stay out of the tree.
+    return subprocess.Popen(command, cwd=workdir, env=dict(env, PYTHONPATH=ROOT))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=["sync", "async"], default="sync")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8, help="gunicorn threads per worker (sync mode)")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated client concurrency levels")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per run")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds of unrecorded load before each scenario")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--queries", type=int, default=20, help="distinct search terms to draw from")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra app setting")
+    parser.add_argument("--json", help="also write the results to this file")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    scenarios = args.scenarios.split(",")
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(unknown)}")
+    levels = [int(level) for level in args.concurrency.split(",")]
+    queries = query_pool(args.queries)
+
+    stub_port, app_port = free_port(), free_port()
+    stub_base = f"http://127.0.0.1:{stub_port}"
+    base = f"http://127.0.0.1:{app_port}"
+    stub_args = ["--latency", str(args.latency), "--jitter", str(args.jitter), "--error-rate", str(args.error_rate),
+                 "--image-kb", str(args.image_kb)] + [arg for slow in args.slow or [] for arg in ("--slow", slow)]
+
+    workdir = tempfile.mkdtemp(prefix="pixerest-bench-")
+    env = dict(os.environ, LOG_LEVEL="ERROR", **provider_env(stub_base))
+    env.update(setting.split("=", 1) for setting in args.env)
+
+    stubs = subprocess.Popen([sys.executable, STUBS, "--port", str(stub_port)] + stub_args,
+                             stdout=subprocess.DEVNULL)
+    server = None
+    results = []
+    try:
+        wait_for(f"{stub_base}/nekos/api/v2/img/neko")
+        server = start_app(args, app_port, env, workdir)
+        wait_for(f"{base}/cache_stats")
+
+        print(f"mode={args.mode} workers={args.workers} upstream={args.latency:g}±{args.jitter:g}ms "
+              f"errors={args.error_rate:g} queries={args.queries}")
+        print(f"{'scenario':<18} {'conc':>5} {'requests':>9} {'errors':>7} {'req/s':>8} "
+              f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'RSS MiB':>8}")
+        for name in scenarios:
+            if args.warmup:
+                run_load(base, SCENARIOS[name], queries, stub_base, levels[0], args.warmup, args.seed)
+            for level in levels:
+                result = run_load(base, SCENARIOS[name], queries, stub_base, level, args.duration, args.seed)
+                result.update(scenario=name, concurrency=level, rss_bytes=process_tree_rss(server.pid))
+                results.append(result)
+                print(f"{name:<18} {level:>5} {result['requests']:>9} {result['errors']:>7} {result['rps']:>8.1f} "
+                      f"{result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f} "
+                      f"{result['rss_bytes'] / 2 ** 20:>8.1f}")
+    finally:
+        for process in (server, stubs):
+            if process is not None:
+                process.terminate()
+                process.wait(timeout=10)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""Local stand-ins for the upstream providers, for offline benchmarking.
+
+One threaded HTTP server answers for every provider under its own prefix,
+replaying the fixtures in bench/fixtures with configurable latency, jitter and
+error injection:
+
+    /unsplash/...            Unsplash API          (unsplash_search.json)
+    /pexels/v1/...           Pexels API            (pexels_search.json)
+    /artic/api/v1/...        Art Institute API     (artic_search.json)
+    /nekos/api/v2/img/neko   nekos.life            (nekos_neko.json)
+    /wallpaperflare/search   WallpaperFlare pages  (wallpaperflare_search.html)
+    /files/<name>.jpg        image bytes for /download_image
+
+Run it on its own to point a manually started app at it:
+
+    python bench/stubs.py --port 8900 --latency 80 --jitter 30 --error-rate 0.02
+
+``provider_env(base)`` gives the environment variables that redirect the app.
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+PROVIDERS = ("unsplash", "pexels", "artic", "nekos", "wallpaperflare", "files")
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name), "rb") as f:
+        data = f.read()
+    return json.loads(data) if name.endswith(".json") else data
+
+
+class StubConfig:
+    """Latency (seconds), jitter (seconds, +/-) and error rate per provider."""
+
+    def __init__(self, latency=0.08, jitter=0.03, error_rate=0.0, image_bytes=512 * 1024, overrides=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.image_bytes = image_bytes
+        self.overrides = overrides or {}
+
+    def delay(self, provider):
+        latency = self.overrides.get(provider, self.latency)
+        return max(latency + random.uniform(-self.jitter, self.jitter), 0)
+
+    def fails(self):
+        return random.random() < self.error_rate
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = StubConfig()
+    fixtures = {}
+
+    def log_message(self, *args):
+        pass
+
+    def handle(self):
+        # Clients dropping idle keep-alive connections is routine here.
+        try:
+            super().handle()
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        provider = url.path.strip("/").split("/", 1)[0]
+        if provider not in PROVIDERS:
+            self.send_body(404, b"not found", "text/plain")
+            return
+
+        time.sleep(self.config.delay(provider))
+        if self.config.fails():
+            self.send_body(500, b'{"errors": ["injected failure"]}', "application/json")
+            return
+
+        if provider == "files":
+            self.send_body(200, self.fixtures["image"], "image/jpeg")
+        elif provider == "wallpaperflare":
+            self.send_body(200, self.fixtures["wallpaperflare"], "text/html; charset=utf-8")
+        elif provider == "nekos":
+            self.send_json(random.choice(self.fixtures["nekos"]))
+        else:
+            self.send_json(self.api_response(provider, url.path, params))
+
+    def api_response(self, provider, path, params):
+        data = self.fixtures[provider]
+        if provider == "unsplash":
+            results = data["results"][:int(params.get("per_page", 10))]
+            return dict(data, results=results) if path.endswith("/search/photos") else results
+        if provider == "pexels":
+            return dict(data, photos=data["photos"][:int(params.get("per_page", 15))])
+        return dict(data, data=data["data"][:int(params.get("limit", 12))])
+
+    def send_json(self, payload):
+        self.send_body(200, json.dumps(payload).encode(), "application/json")
+
+    def send_body(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_stubs(config, host="127.0.0.1", port=0):
+    """Start the stub server on a daemon thread; returns ``(server, base_url)``."""
+    handler = type("ConfiguredStubHandler", (StubHandler,), {
+        "config": config,
+        "fixtures": {
+            "unsplash": load_fixture("unsplash_search.json"),
+            "pexels": load_fixture("pexels_search.json"),
+            "artic": load_fixture("artic_search.json"),
+            "nekos": load_fixture("nekos_neko.json"),
+            "wallpaperflare": load_fixture("wallpaperflare_search.html"),
+            "image": os.urandom(config.image_bytes),
+        },
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="bench-stubs", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def provider_env(base):
+    """Environment that points the app's providers at the stub server."""
+    return {
+        "UNSPLASH_API_URL": f"{base}/unsplash",
+        "PEXELS_API_URL": f"{base}/pexels/v1",
+        "ARTIC_API_URL": f"{base}/artic/api/v1",
+        "NEKO_API_URL": f"{base}/nekos/api/v2/img/neko",
+        "WALLPAPERFLARE_URL": f"{base}/wallpaperflare",
+        "UNSPLASH_ACCESS_KEY": "bench",
+        "PEXELS_API_KEY": "bench",
+        # The stand-ins have no quota; keep the token buckets out of the way.
+        "UNSPLASH_RATE_LIMIT": "1000000",
+        "PEXELS_RATE_LIMIT": "1000000",
+        "ARTIC_RATE_LIMIT": "1000000",
+    }
+
+
+def parse_overrides(values):
+    """``["unsplash=300", ...]`` (milliseconds) -> ``{"unsplash": 0.3}``."""
+    overrides = {}
+    for value in values or []:
+        provider, _, ms = value.partition("=")
+        overrides[provider] = float(ms) / 1000
+    return overrides
+
+
+def add_stub_arguments(parser):
+    parser.add_argument("--latency", type=float, default=80, help="upstream latency in ms")
+    parser.add_argument("--jitter", type=float, default=30, help="+/- latency jitter in ms")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of upstream calls answered with 500")
+    parser.add_argument("--slow", action="append", metavar="PROVIDER=MS", help="latency override for one provider")
+    parser.add_argument("--image-kb", type=int, default=512, help="size of the files served to /download_image")
+
+
+def stub_config(args):
+    return StubConfig(
+        latency=args.latency / 1000,
+        jitter=args.jitter / 1000,
+        error_rate=args.error_rate,
+        image_bytes=args.image_kb * 1024,
+        overrides=parse_overrides(args.slow),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8900)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    server, base = start_stubs(stub_config(args), port=args.port)
+    print(f"Stub providers listening on {base}; start the app with:\n")
+    for key, value in provider_env(base).items():
+        print(f"export {key}={value}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
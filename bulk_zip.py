@@ -0,0 +1,156 @@
+import io
+import logging
+import mimetypes
+import os
+import re
+import tempfile
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import unquote, urlparse
+
+import http_client
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# BULK DOWNLOAD SETTINGS
+# An archive fetches at most BULK_CONCURRENCY images at once from a pool of
+# BULK_POOL_WORKERS threads shared by every archive. Each image is buffered in
+# a spooled file (memory up to BULK_SPOOL_BYTES, then disk) until it is its
+# turn to be written, so an archive holds at most BULK_CONCURRENCY spools in
+# memory no matter how many images it has. Archives are capped at
+# BULK_MAX_ITEMS images and BULK_MAX_BYTES of image data; single images at
+# BULK_ITEM_MAX_BYTES.
+BULK_MAX_ITEMS = int(os.environ.get("BULK_MAX_ITEMS", 100))
+BULK_MAX_BYTES = int(os.environ.get("BULK_MAX_BYTES", 300 * 1024 * 1024))
+BULK_ITEM_MAX_BYTES = int(os.environ.get("BULK_ITEM_MAX_BYTES", 50 * 1024 * 1024))
+BULK_CONCURRENCY = int(os.environ.get("BULK_CONCURRENCY", 4))
+BULK_POOL_WORKERS = int(os.environ.get("BULK_POOL_WORKERS", 16))
+BULK_SPOOL_BYTES = int(os.environ.get("BULK_SPOOL_BYTES", 1024 * 1024))
+BULK_TIMEOUT = float(os.environ.get("BULK_TIMEOUT", 15))
+BULK_CHUNK_SIZE = 64 * 1024
+
+bulk_executor = ThreadPoolExecutor(max_workers=BULK_POOL_WORKERS, thread_name_prefix="bulk-fetch")
+
+
+class ZipSink(io.RawIOBase):
+    """Write-only, unseekable target for ZipFile; the generator drains it after each write."""
+
+    def __init__(self):
+        self.parts = []
+        self.offset = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def drain(self):
+        data, self.parts = b"".join(self.parts), []
+        return data
+
+
+def fetch_to_spool(url, max_bytes=BULK_ITEM_MAX_BYTES):
+    """Download ``url`` into a spooled temp file; returns ``(spool, size, content_type)``."""
+    with http_client.get(url, stream=True, timeout=BULK_TIMEOUT) as response:
+        response.raise_for_status()
+        content_length = response.headers.get("Content-Length")
+        if content_length and int(content_length) > max_bytes:
+            raise ValueError(f"larger than {max_bytes} bytes")
+
+        spool = tempfile.SpooledTemporaryFile(max_size=BULK_SPOOL_BYTES)
+        size = 0
+        try:
+            for chunk in response.iter_content(chunk_size=BULK_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ValueError(f"larger than {max_bytes} bytes")
+                spool.write(chunk)
+                metrics.download_bytes.inc(amount=len(chunk))
+        except BaseException:
+            spool.close()
+            raise
+        spool.seek(0)
+        return spool, size, response.headers.get("Content-Type", "")
+
+
+def archive_name(index, url, content_type):
+    """``003-name.jpg`` from the URL path; the index keeps names unique and in request order."""
+    name = os.path.basename(unquote(urlparse(url).path)) or "image"
+    name = re.sub(r"[^\w.\-]+", "_", name)[:80]
+    if not os.path.splitext(name)[1]:
+        name += mimetypes.guess_extension(content_type.split(";")[0].strip()) or ".jpg"
+    return f"{index + 1:03d}-{name}"
+
+
+def stream_zip(urls, skipped=(), fetch=fetch_to_spool):
+    """Yield a ZIP of ``urls`` as it is built, fetching up to BULK_CONCURRENCY images ahead.
+
+    Images are added in the order they finish downloading. Failures (and the
+    ``(url, reason)`` pairs in ``skipped``) are listed in errors.txt instead of
+    aborting the archive.
+    """
+    sink = ZipSink()
+    archive = zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED)
+    errors = list(skipped)
+    queue = list(enumerate(urls))
+    running = {}
+    written = 0
+
+    def submit_next():
+        while queue and len(running) < BULK_CONCURRENCY:
+            index, url = queue.pop(0)
+            # No single image may be bigger than what is left of the archive budget.
+            max_bytes = min(BULK_ITEM_MAX_BYTES, BULK_MAX_BYTES - written)
+            running[bulk_executor.submit(fetch, url, max_bytes)] = (index, url)
+
+    try:
+        submit_next()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, url = running.pop(future)
+                try:
+                    spool, size, content_type = future.result()
+                except Exception as e:
+                    errors.append((url, str(e)))
+                    continue
+
+                with spool:
+                    if written + size > BULK_MAX_BYTES:
+                        # Budget spent by images that finished first: fetch nothing more.
+                        limit = f"archive limit of {BULK_MAX_BYTES} bytes reached"
+                        errors.extend((pending_url, limit) for _, pending_url in [(index, url)] + queue)
+                        queue.clear()
+                        continue
+                    with archive.open(archive_name(index, url, content_type), "w") as entry:
+                        for chunk in iter(lambda: spool.read(BULK_CHUNK_SIZE), b""):
+                            entry.write(chunk)
+                            yield sink.drain()
+                    written += size
+                yield sink.drain()
+            submit_next()
+
+        if errors:
+            archive.writestr("errors.txt", "".join(f"{url}\t{reason}\n" for url, reason in errors))
+        archive.close()
+        yield sink.drain()
+    finally:
+        # Client went away (or we are done): stop fetching and free any spools still held.
+        for future in running:
+            if not future.cancel():
+                future.add_done_callback(_close_spool)
+        if errors:
+            logger.info("bulk download skipped %s of %s images", len(errors), len(urls) + len(skipped))
+
+
+def _close_spool(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result()[0].close()
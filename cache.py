@@ -0,0 +1,314 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from singleflight import AsyncSingleFlight, SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+# RESPONSE CACHE SETTINGS
+# Entries younger than CACHE_TTL are fresh. Until CACHE_TTL + CACHE_STALE_TTL
+# they are still served, but a background refresh is started. Older entries
+# are treated as misses.
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "memory")
+CACHE_PATH = os.environ.get("CACHE_PATH", "pixerest_cache.sqlite3")
+CACHE_TTL = float(os.environ.get("CACHE_TTL", 300))
+CACHE_STALE_TTL = float(os.environ.get("CACHE_STALE_TTL", 900))
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", 2048))
+CACHE_REFRESH_WORKERS = int(os.environ.get("CACHE_REFRESH_WORKERS", 4))
+# How long another worker waits for a fetch already leased by a sibling worker
+# (shared backend only) before giving up and fetching itself.
+CACHE_LEASE_TIMEOUT = float(os.environ.get("CACHE_LEASE_TIMEOUT", 8))
+
+
+class MemoryBackend:
+    """In-process LRU store. Each gunicorn worker keeps its own copy."""
+
+    blocking = False
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, stored_at):
+        with self.lock:
+            self.entries[key] = (value, stored_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SQLiteBackend:
+    """Shared LRU store in a local SQLite file, usable by several workers."""
+
+    # Disk I/O: the async paths call it from a thread, not the event loop.
+    blocking = True
+
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.local = threading.local()
+        self.evictions = 0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "stored_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed_at)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                "key TEXT PRIMARY KEY, owner INTEGER NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute("SELECT value, stored_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, stored_at):
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, stored_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value), stored_at, time.time()),
+        )
+        evicted = conn.execute(
+            "DELETE FROM cache WHERE key IN ("
+            "SELECT key FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        ).rowcount
+        self.evictions += max(evicted, 0)
+
+    def acquire_lease(self, key, timeout):
+        """Claim the right to fetch ``key`` across workers. Returns False if a live lease exists."""
+        conn = self._connect()
+        now = time.time()
+        conn.execute("DELETE FROM leases WHERE key = ? AND expires_at < ?", (key, now))
+        acquired = conn.execute(
+            "INSERT OR IGNORE INTO leases (key, owner, expires_at) VALUES (?, ?, ?)",
+            (key, os.getpid(), now + timeout),
+        ).rowcount
+        return acquired == 1
+
+    def lease_held(self, key):
+        row = self._connect().execute(
+            "SELECT 1 FROM leases WHERE key = ? AND expires_at >= ?", (key, time.time())
+        ).fetchone()
+        return row is not None
+
+    def release_lease(self, key):
+        self._connect().execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, os.getpid()))
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+
+class ResponseCache:
+    """TTL + LRU cache with stale-while-revalidate in front of provider calls.
+
+    Only successful fetches are stored; an exception from ``fetch`` is passed
+    straight to the caller and never cached.
+    """
+
+    def __init__(self, backend, ttl=CACHE_TTL, stale_ttl=CACHE_STALE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.refresher = ThreadPoolExecutor(max_workers=CACHE_REFRESH_WORKERS, thread_name_prefix="cache-refresh")
+        self.refreshing = set()
+        self.lock = threading.Lock()
+        self.flight = SingleFlight()
+        self.async_flight = AsyncSingleFlight()
+        self.async_tasks = set()
+        self.counters = {
+            "hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "refresh_errors": 0,
+            "lease_waits": 0, "lease_hits": 0, "fallback_hits": 0,
+        }
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def get_or_fetch(self, key, fetch):
+        entry = self.backend.get(key)
+        if entry is not None:
+            value, stored_at = entry
+            age = time.time() - stored_at
+            if age < self.ttl:
+                self._count("hits")
+                return value
+            if age < self.ttl + self.stale_ttl:
+                self._count("stale_hits")
+                self._refresh_in_background(key, fetch)
+                return value
+
+        self._count("misses")
+        return self.flight.do(key, lambda: self._fetch_and_store(key, fetch))
+
+    def peek(self, key):
+        """Return whatever is stored for ``key``, however old, without fetching.
+
+        Used when a provider cannot be called at all (e.g. its rate budget is
+        spent); an outdated page beats an empty one.
+        """
+        entry = self.backend.get(key)
+        if entry is None:
+            return None
+        self._count("fallback_hits")
+        return entry[0]
+
+    async def aget_or_fetch(self, key, fetch):
+        """Async twin of ``get_or_fetch``; ``fetch`` returns an awaitable."""
+        entry = await self._abackend("get", key)
+        if entry is not None:
+            value, stored_at = entry
+            age = time.time() - stored_at
+            if age < self.ttl:
+                self._count("hits")
+                return value
+            if age < self.ttl + self.stale_ttl:
+                self._count("stale_hits")
+                self._arefresh_in_background(key, fetch)
+                return value
+
+        self._count("misses")
+        return await self.async_flight.do(key, lambda: self._afetch_and_store(key, fetch))
+
+    async def _afetch_and_store(self, key, fetch):
+        value = await fetch()
+        await self._abackend("set", key, value, time.time())
+        return value
+
+    async def _abackend(self, method, *args):
+        call = getattr(self.backend, method)
+        if self.backend.blocking:
+            return await asyncio.to_thread(call, *args)
+        return call(*args)
+
+    def _arefresh_in_background(self, key, fetch):
+        with self.lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+        task = asyncio.ensure_future(self._arefresh(key, fetch))
+        # Keep a reference so the task is not garbage collected mid-flight.
+        self.async_tasks.add(task)
+        task.add_done_callback(self.async_tasks.discard)
+
+    async def _arefresh(self, key, fetch):
+        try:
+            await self._abackend("set", key, await fetch(), time.time())
+            self._count("refreshes")
+        except Exception as e:
+            self._count("refresh_errors")
+            logger.warning("background refresh failed for %s: %s", key, e)
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+    def _fetch_and_store(self, key, fetch):
+        # With a shared backend, a sibling worker may already be fetching this
+        # key; wait for its result instead of spending another upstream call.
+        leased = True
+        if hasattr(self.backend, "acquire_lease"):
+            leased = self.backend.acquire_lease(key, CACHE_LEASE_TIMEOUT)
+            if not leased:
+                self._count("lease_waits")
+                value = self._wait_for_sibling(key)
+                if value is not None:
+                    self._count("lease_hits")
+                    return value
+
+        try:
+            value = fetch()
+            self.backend.set(key, value, time.time())
+            return value
+        finally:
+            if leased and hasattr(self.backend, "release_lease"):
+                self.backend.release_lease(key)
+
+    def _wait_for_sibling(self, key):
+        deadline = time.monotonic() + CACHE_LEASE_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            entry = self.backend.get(key)
+            if entry is not None and time.time() - entry[1] < self.ttl:
+                return entry[0]
+            if not self.backend.lease_held(key):
+                break
+        return None
+
+    def _refresh_in_background(self, key, fetch):
+        with self.lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+        self.refresher.submit(self._refresh, key, fetch)
+
+    def _refresh(self, key, fetch):
+        try:
+            self.backend.set(key, fetch(), time.time())
+            self._count("refreshes")
+        except Exception as e:
+            self._count("refresh_errors")
+            logger.warning("background refresh failed for %s: %s", key, e)
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+        lookups = stats["hits"] + stats["stale_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["hits"] + stats["stale_hits"]) / lookups, 4) if lookups else 0.0
+        stats["entries"] = len(self.backend)
+        stats["evictions"] = self.backend.evictions
+        stats["backend"] = type(self.backend).__name__
+        stats["singleflight"] = self.flight.stats()
+        stats["async_singleflight"] = self.async_flight.stats()
+        stats["upstream_calls_saved"] = (stats["singleflight"]["coalesced"] + stats["async_singleflight"]["coalesced"]
+                                         + stats["lease_hits"])
+        return stats
+
+
+def build_cache():
+    if CACHE_BACKEND == "sqlite":
+        backend = SQLiteBackend(CACHE_PATH)
+    else:
+        backend = MemoryBackend()
+    return ResponseCache(backend)
+
+
+response_cache = build_cache()
@@ -0,0 +1,163 @@
+import base64
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+# CURSOR PAGINATION SETTINGS
+# Each query gets a server-side buffer of merged, de-duplicated results. A
+# provider is only called again once its own buffered items have all been
+# merged. At most CURSOR_MAX_QUERIES buffers are kept (LRU), each expires
+# CURSOR_TTL seconds after its last use and holds at most CURSOR_MAX_ITEMS.
+CURSOR_MAX_QUERIES = int(os.environ.get("CURSOR_MAX_QUERIES", 256))
+CURSOR_TTL = float(os.environ.get("CURSOR_TTL", 600))
+CURSOR_MAX_ITEMS = int(os.environ.get("CURSOR_MAX_ITEMS", 2000))
+# A provider that fails this many rounds in a row is treated as exhausted.
+CURSOR_MAX_FAILURES = 2
+
+
+class InvalidCursor(ValueError):
+    """Raised for a cursor that cannot be decoded."""
+
+
+def encode_cursor(query, offset):
+    payload = json.dumps({"q": query, "o": offset}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return str(payload["q"]), max(int(payload["o"]), 0)
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {e}")
+
+
+class ProviderBuffer:
+    def __init__(self):
+        self.items = deque()
+        self.next_page = 1
+        self.exhausted = False
+        self.failures = 0
+
+
+class QueryBuffer:
+    """Merged results for one query, filled from per-provider buffers."""
+
+    def __init__(self, query, providers):
+        self.query = query
+        self.providers = {name: ProviderBuffer() for name in providers}
+        self.items = []
+        self.seen = set()
+        self.lock = threading.Lock()
+        self.used_at = time.monotonic()
+        # Same query, same merge order, in every worker and after expiry. This
+        # relies on every provider returning the same pages to every worker,
+        # which is why cursor feeds only use remote providers.
+        self.seed = int(hashlib.sha256(query.encode()).hexdigest()[:8], 16)
+
+    @property
+    def exhausted(self):
+        return all(buffer.exhausted and not buffer.items for buffer in self.providers.values())
+
+    def merge(self, want):
+        """Interleave buffered provider items into ``items`` until ``want`` are merged."""
+        while len(self.items) < min(want, CURSOR_MAX_ITEMS):
+            ready = [name for name, buffer in self.providers.items() if buffer.items]
+            # Stop once a provider that can still produce has run dry, so its
+            # share is refilled instead of being skipped.
+            if not ready or any(not b.items and not b.exhausted for b in self.providers.values()):
+                return
+            random.Random(self.seed + len(self.items)).shuffle(ready)
+            for name in ready:
+                img = self.providers[name].items.popleft()
+                if img["url"] not in self.seen:
+                    self.seen.add(img["url"])
+                    self.items.append(img)
+
+    def needs_fetch(self):
+        return [name for name, buffer in self.providers.items() if not buffer.items and not buffer.exhausted]
+
+
+class CursorPager:
+    """Serve stable, gap-free pages of mixed provider results behind an opaque cursor.
+
+    ``fetch_round(query, pages)`` receives ``{provider: provider_page}`` for the
+    providers whose buffers are empty and returns ``{provider: images}``, with
+    ``None`` for a provider that failed and ``[]`` once it has no more results.
+    """
+
+    def __init__(self, fetch_round):
+        self.fetch_round = fetch_round
+        self.buffers = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {"pages": 0, "provider_calls": 0, "buffers_created": 0, "buffers_expired": 0}
+
+    def _buffer(self, query, providers):
+        key = query.strip().lower()
+        now = time.monotonic()
+        with self.lock:
+            for stale_key in [k for k, b in self.buffers.items() if now - b.used_at > CURSOR_TTL]:
+                del self.buffers[stale_key]
+                self.counters["buffers_expired"] += 1
+
+            buffer = self.buffers.get(key)
+            if buffer is None:
+                buffer = self.buffers[key] = QueryBuffer(key, providers)
+                self.counters["buffers_created"] += 1
+                while len(self.buffers) > CURSOR_MAX_QUERIES:
+                    self.buffers.popitem(last=False)
+            self.buffers.move_to_end(key)
+            buffer.used_at = now
+            return buffer
+
+    def page(self, query, offset, count, providers, deadline):
+        buffer = self._buffer(query, providers)
+        started = time.monotonic()
+        with buffer.lock:
+            buffer.merge(offset + count)
+            while len(buffer.items) < offset + count and len(buffer.items) < CURSOR_MAX_ITEMS:
+                wanted = buffer.needs_fetch()
+                if not wanted or time.monotonic() - started > deadline:
+                    break
+                pages = {name: buffer.providers[name].next_page for name in wanted}
+                results = self.fetch_round(query, pages)
+                with self.lock:
+                    self.counters["provider_calls"] += len(pages)
+                for name in wanted:
+                    provider = buffer.providers[name]
+                    images = results.get(name)
+                    if images is None:
+                        provider.failures += 1
+                        provider.exhausted = provider.failures >= CURSOR_MAX_FAILURES
+                    elif not images:
+                        provider.exhausted = True
+                    else:
+                        provider.failures = 0
+                        provider.next_page += 1
+                        provider.items.extend(images)
+                buffer.merge(offset + count)
+            if buffer.exhausted or len(buffer.items) >= CURSOR_MAX_ITEMS:
+                # Nothing more can arrive; release whatever is merged.
+                buffer.merge(CURSOR_MAX_ITEMS)
+
+            images = buffer.items[offset:offset + count]
+            more = offset + len(images) < len(buffer.items) or not buffer.exhausted
+            more = more and offset + len(images) < CURSOR_MAX_ITEMS
+            buffered = {name: len(p.items) for name, p in buffer.providers.items()}
+
+        with self.lock:
+            self.counters["pages"] += 1
+        next_cursor = encode_cursor(query, offset + len(images)) if more and images else None
+        return images, next_cursor, buffered
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["buffers"] = len(self.buffers)
+        return stats
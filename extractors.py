@@ -0,0 +1,87 @@
+from bs4 import BeautifulSoup
+from lxml import etree
+
+
+class FigureImageExtractor:
+    """Incremental ``data-src`` extractor; feed it chunks as they arrive.
+
+    Only figure/img events are inspected and finished elements are dropped
+    as we go, so memory stays flat however large the page is.
+    """
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.parser = etree.HTMLPullParser(events=("start", "end"), tag=("figure", "img"))
+        self.images = []
+        self.in_figure = 0
+        self.figure_has_img = False
+
+    @property
+    def full(self):
+        return self.limit is not None and len(self.images) >= self.limit
+
+    def feed(self, chunk):
+        """Parse one chunk. Returns True once ``limit`` URLs have been found."""
+        if chunk:
+            self.parser.feed(chunk)
+            self._read_events()
+        return self.full
+
+    def close(self):
+        if not self.full:
+            self.parser.close()
+            self._read_events()
+        return self.images[:self.limit] if self.limit is not None else self.images
+
+    def _read_events(self):
+        for event, element in self.parser.read_events():
+            if self.full:
+                return
+            if element.tag == "figure":
+                if event == "start":
+                    self.in_figure += 1
+                    self.figure_has_img = False
+                else:
+                    self.in_figure -= 1
+                    _discard(element)
+            elif event == "start" and self.in_figure and not self.figure_has_img:
+                self.figure_has_img = True
+                src = element.get("data-src")
+                if src is not None:
+                    self.images.append(src)
+
+
+def extract_figure_images(chunks, limit=None):
+    """Pull ``data-src`` from the first ``<img>`` of every ``<figure>``.
+
+    ``chunks`` is an iterable of bytes (e.g. ``response.iter_content()``).
+    Reading stops as soon as ``limit`` URLs have been found.
+    """
+    extractor = FigureImageExtractor(limit)
+    for chunk in chunks:
+        if extractor.feed(chunk):
+            break
+    return extractor.close()
+
+
+def _discard(element):
+    # Keep the partial tree small: drop the finished element and any
+    # already-processed siblings before it.
+    element.clear()
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+
+
+def extract_figure_images_bs4(html):
+    """Reference implementation using a full BeautifulSoup tree."""
+    soup = BeautifulSoup(html, "html.parser")
+    images = []
+
+    for fig in soup.find_all("figure"):
+        img = fig.find("img")
+        if img and "data-src" in img.attrs:
+            images.append(img["data-src"])
+
+    return images
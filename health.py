@@ -0,0 +1,164 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+# CIRCUIT BREAKER SETTINGS
+# A provider trips open when BREAKER_FAILURES calls in a row fail, or when at
+# least half of a full HEALTH_WINDOW failed. After BREAKER_COOLDOWN seconds a
+# single half-open probe is let through; it closes or re-opens the breaker.
+HEALTH_WINDOW = int(os.environ.get("HEALTH_WINDOW", 20))
+BREAKER_FAILURES = int(os.environ.get("BREAKER_FAILURES", 3))
+BREAKER_COOLDOWN = float(os.environ.get("BREAKER_COOLDOWN", 30))
+# Providers slower than this (seconds, window average) get a smaller share of
+# each page; the share never drops below MIN_QUOTA_FACTOR.
+SLOW_LATENCY = float(os.environ.get("SLOW_LATENCY", 1.5))
+MIN_QUOTA_FACTOR = float(os.environ.get("MIN_QUOTA_FACTOR", 0.25))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose breaker is open."""
+
+
+class ProviderHealth:
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.window = deque(maxlen=HEALTH_WINDOW)
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_started_at = None
+        self.last_error = None
+
+    def allow(self):
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state == OPEN and now - self.opened_at >= BREAKER_COOLDOWN:
+                self.state = HALF_OPEN
+                self.probe_started_at = None
+            if self.state == HALF_OPEN:
+                # One probe at a time; a probe that never reported back is
+                # abandoned after another cooldown.
+                if self.probe_started_at is None or now - self.probe_started_at >= BREAKER_COOLDOWN:
+                    self.probe_started_at = now
+                    return True
+            return False
+
+    def record(self, ok, latency, error=None):
+        with self.lock:
+            self.window.append((ok, latency))
+            if ok:
+                self.consecutive_failures = 0
+                if self.state != CLOSED:
+                    logger.info("%s circuit closed", self.name)
+                self.state = CLOSED
+                return
+
+            self.consecutive_failures += 1
+            self.last_error = error
+            failures = sum(1 for sample_ok, _ in self.window if not sample_ok)
+            window_full = len(self.window) == self.window.maxlen
+            if (self.state == HALF_OPEN
+                    or self.consecutive_failures >= BREAKER_FAILURES
+                    or (window_full and failures * 2 >= len(self.window))):
+                if self.state != OPEN:
+                    logger.warning("%s circuit opened: %s", self.name, error)
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def average_latency(self):
+        latencies = [latency for _, latency in self.window]
+        return sum(latencies) / len(latencies) if latencies else 0.0
+
+    def quota_factor(self):
+        """Share of its normal page quota this provider should contribute."""
+        with self.lock:
+            average = self.average_latency()
+        if average <= SLOW_LATENCY:
+            return 1.0
+        return max(MIN_QUOTA_FACTOR, SLOW_LATENCY / average)
+
+    def snapshot(self):
+        with self.lock:
+            samples = len(self.window)
+            errors = sum(1 for ok, _ in self.window if not ok)
+            return {
+                "state": self.state,
+                "samples": samples,
+                "error_rate": round(errors / samples, 3) if samples else 0.0,
+                "avg_latency": round(self.average_latency(), 3),
+                "consecutive_failures": self.consecutive_failures,
+                "last_error": self.last_error,
+            }
+
+
+class ProviderRegistry:
+    def __init__(self, names):
+        self.providers = {name: ProviderHealth(name) for name in names}
+
+    def __getitem__(self, name):
+        return self.providers[name]
+
+    def call(self, name, fn, deadline):
+        """Run ``fn`` through ``name``'s breaker and record its outcome.
+
+        A call that succeeds but takes longer than ``deadline`` counts as a
+        failure, since its results arrive too late to be shown.
+        """
+        health = self.providers[name]
+        if not health.allow():
+            raise CircuitOpenError(f"{name} circuit open, skipping")
+
+        started = time.monotonic()
+        try:
+            result = fn()
+        except Exception as e:
+            health.record(False, time.monotonic() - started, str(e))
+            raise
+        latency = time.monotonic() - started
+        if latency > deadline:
+            health.record(False, latency, f"Slow response ({latency:.1f}s)")
+        else:
+            health.record(True, latency)
+        return result
+
+    async def acall(self, name, fn, deadline):
+        """Async twin of ``call``; ``fn`` returns an awaitable."""
+        health = self.providers[name]
+        if not health.allow():
+            raise CircuitOpenError(f"{name} circuit open, skipping")
+
+        started = time.monotonic()
+        try:
+            result = await fn()
+        except Exception as e:
+            health.record(False, time.monotonic() - started, str(e))
+            raise
+        latency = time.monotonic() - started
+        if latency > deadline:
+            health.record(False, latency, f"Slow response ({latency:.1f}s)")
+        else:
+            health.record(True, latency)
+        return result
+
+    def quota(self, name, limit):
+        if limit <= 0:
+            return limit
+        return max(1, int(limit * self.providers[name].quota_factor()))
+
+    def snapshot(self):
+        return {name: health.snapshot() for name, health in self.providers.items()}
+
+
+provider_health = ProviderRegistry(["unsplash", "pexels", "nekos", "artic", "wallpaperflare"])
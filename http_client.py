@@ -0,0 +1,62 @@
+import os
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# CONNECTION POOL SETTINGS
+# One pool per upstream host (unsplash, pexels, nekos, artic, wallpaperflare,
+# image CDNs) is kept warm so repeat calls skip the TCP/TLS handshake.
+HTTP_POOL_CONNECTIONS = int(os.environ.get("HTTP_POOL_CONNECTIONS", 16))
+HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", 32))
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", 2))
+HTTP_BACKOFF = float(os.environ.get("HTTP_BACKOFF", 0.3))
+
+
+def build_session():
+    """Create a pooled, keep-alive session with a bounded retry policy.
+
+    Only idempotent requests are retried, and only on connection errors or
+    gateway-style statuses, so a failing provider never burns more than
+    ``HTTP_RETRIES`` extra attempts.
+    """
+    retry = Retry(
+        total=HTTP_RETRIES,
+        backoff_factor=HTTP_BACKOFF,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        max_retries=retry,
+    )
+
+    new_session = requests.Session()
+    new_session.mount("https://", adapter)
+    new_session.mount("http://", adapter)
+    # Cookies would be shared between every user and worker thread, and bare
+    # requests.get never kept them anyway, so the jar stays empty.
+    new_session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return new_session
+
+
+session = build_session()
+
+
+def _reset_after_fork():
+    # Sockets opened before gunicorn forks must not be shared with the child.
+    global session
+    session = build_session()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get(url, **kwargs):
+    """Drop-in replacement for ``requests.get`` that reuses pooled connections."""
+    return session.get(url, **kwargs)
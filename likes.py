@@ -0,0 +1,154 @@
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# LIKE STORE SETTINGS
+# Likes are added up in memory and written to SQLite in one transaction every
+# LIKES_FLUSH_INTERVAL seconds (or sooner once LIKES_FLUSH_BATCH distinct
+# images are pending), so a popular image costs one row update per flush
+# rather than one per click.
+LIKES_DB = os.environ.get("LIKES_DB", "likes.sqlite3")
+LIKES_FLUSH_INTERVAL = float(os.environ.get("LIKES_FLUSH_INTERVAL", 2))
+LIKES_FLUSH_BATCH = int(os.environ.get("LIKES_FLUSH_BATCH", 500))
+
+# SQLite's default limit on bound parameters is 999 on older builds.
+LOOKUP_CHUNK = 500
+
+
+class LikeStore:
+    def __init__(self, path=LIKES_DB):
+        self.path = path
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        # Only one flush at a time; readers never wait for it.
+        self.flush_lock = threading.Lock()
+        self.pending = {}
+        # The batch being written. Readers keep counting it from memory until
+        # it is committed; ``generation`` is odd while the COMMIT runs, when a
+        # SELECT may or may not already see it.
+        self.flushing = {}
+        self.generation = 0
+        self.flush_wanted = threading.Event()
+        self.thread = None
+        self.counters = {"likes": 0, "flushes": 0, "rows_written": 0}
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS likes (url TEXT PRIMARY KEY, count INTEGER NOT NULL)"
+        )
+
+    def _connect(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def _start(self):
+        # Lazy so every gunicorn worker starts its own flusher after fork.
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.thread = threading.Thread(target=self._run, name="likes-flush", daemon=True)
+        self.thread.start()
+
+    def like(self, url):
+        """Record one like and return the image's new total."""
+        with self.lock:
+            self._start()
+            self.pending[url] = self.pending.get(url, 0) + 1
+            self.counters["likes"] += 1
+            if len(self.pending) >= LIKES_FLUSH_BATCH:
+                self.flush_wanted.set()
+        return self.counts([url])[url]
+
+    def counts(self, urls):
+        """Return ``{url: likes}`` for every url, with one query per chunk."""
+        urls = list(dict.fromkeys(urls))
+        totals = dict.fromkeys(urls, 0)
+        conn = self._connect()
+        while True:
+            with self.lock:
+                generation = self.generation
+                unflushed = {url: self.pending.get(url, 0) + self.flushing.get(url, 0) for url in urls}
+            if generation % 2 == 0:
+                stored = {}
+                for start in range(0, len(urls), LOOKUP_CHUNK):
+                    chunk = urls[start:start + LOOKUP_CHUNK]
+                    placeholders = ",".join("?" * len(chunk))
+                    stored.update(conn.execute(f"SELECT url, count FROM likes WHERE url IN ({placeholders})", chunk))
+                with self.lock:
+                    if self.generation == generation:
+                        break
+            # A batch was committed meanwhile; read again rather than count it twice.
+            time.sleep(0.001)
+
+        for url in urls:
+            totals[url] = stored.get(url, 0) + unflushed[url]
+        return totals
+
+    def _run(self):
+        while True:
+            self.flush_wanted.wait(LIKES_FLUSH_INTERVAL)
+            self.flush_wanted.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logger.warning("like flush failed: %s", e)
+
+    def flush(self):
+        with self.flush_lock:
+            self._flush()
+
+    def _flush(self):
+        with self.lock:
+            batch, self.pending = self.pending, {}
+            self.flushing = batch
+        if not batch:
+            return
+
+        conn = self._connect()
+        committed = False
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT INTO likes (url, count) VALUES (?, ?) "
+                "ON CONFLICT(url) DO UPDATE SET count = count + excluded.count",
+                batch.items(),
+            )
+            with self.lock:
+                self.generation += 1
+            conn.execute("COMMIT")
+            committed = True
+        finally:
+            with self.lock:
+                if not committed:
+                    # Put the batch back so the likes are retried on the next flush.
+                    for url, delta in batch.items():
+                        self.pending[url] = self.pending.get(url, 0) + delta
+                self.flushing = {}
+                if self.generation % 2:
+                    self.generation += 1
+            # BEGIN IMMEDIATE fails without opening a transaction when the
+            # database is locked, e.g. by another worker's flush.
+            if not committed and conn.in_transaction:
+                conn.execute("ROLLBACK")
+
+        with self.lock:
+            self.counters["flushes"] += 1
+            self.counters["rows_written"] += len(batch)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["pending"] = len(self.pending)
+        return stats
+
+
+like_store = LikeStore()
+atexit.register(like_store.flush)
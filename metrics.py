@@ -0,0 +1,214 @@
+"""In-process metrics registry and per-request profiling.
+
+Counters and histograms are kept per process and rendered in the Prometheus
+text format by /metrics; under gunicorn each worker reports its own numbers,
+so scrape every worker or sum them upstream. Collectors registered with
+``registry.collector`` are read at scrape time for state that already lives
+elsewhere (cache, pools, breakers).
+"""
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+# LOGGING
+# LOG_LEVEL=DEBUG shows every provider call; the default only reports problems
+# and one line per /images page.
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "%(asctime)s %(levelname)s %(name)s %(message)s")
+
+
+def configure_logging():
+    logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
+
+
+# PROFILING
+# With PROFILE_REQUESTS=1 a request sent with ?profile=1 or an "X-Profile: 1"
+# header gets its timing breakdown back in a Server-Timing header (and logged).
+PROFILE_REQUESTS = os.environ.get("PROFILE_REQUESTS", "0") == "1"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+current_profile = ContextVar("current_profile", default=None)
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, label_values, value) for label_values, value in self.values.items()]
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    @contextmanager
+    def time(self, *label_values):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for label_values, series in self.series.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, series["counts"]):
+                    cumulative += count
+                    samples.append((f"{self.name}_bucket", label_values + (f"{bound:g}",), cumulative))
+                samples.append((f"{self.name}_bucket", label_values + ("+Inf",), series["count"]))
+                samples.append((f"{self.name}_sum", label_values, series["sum"]))
+                samples.append((f"{self.name}_count", label_values, series["count"]))
+        return samples
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(name, label_names, label_values, value):
+    # repr keeps large byte counters exact where %g would round them.
+    value = repr(float(value)) if isinstance(value, float) else str(int(value))
+    if label_values:
+        pairs = ",".join(f'{label}="{_escape(v)}"' for label, v in zip(label_names, label_values))
+        return f"{name}{{{pairs}}} {value}"
+    return f"{name} {value}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name, help_text, labels=()):
+        metric = Counter(name, help_text, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help_text, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        """Register ``fn() -> [(name, help, labels, [(label_values, value), ...])]`` as gauges."""
+        self.collectors.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            kind = "histogram" if isinstance(metric, Histogram) else "counter"
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {kind}")
+            for name, label_values, value in metric.samples():
+                label_names = metric.labels + ("le",) if name.endswith("_bucket") else metric.labels
+                lines.append(_format(name, label_names, label_values, value))
+
+        for collect in self.collectors:
+            try:
+                gauges = collect()
+            except Exception as e:
+                logging.getLogger(__name__).warning("metrics collector %s failed: %s", collect.__name__, e)
+                continue
+            for name, help_text, labels, samples in gauges:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} gauge")
+                for label_values, value in samples:
+                    lines.append(_format(name, labels, label_values, value))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+request_latency = registry.histogram(
+    "pixerest_request_duration_seconds", "Time spent serving a request.", ("route",))
+provider_latency = registry.histogram(
+    "pixerest_provider_duration_seconds", "Time spent on one upstream provider call.", ("provider",))
+upstream_responses = registry.counter(
+    "pixerest_upstream_responses_total", "Upstream responses by provider and HTTP status.", ("provider", "status"))
+download_bytes = registry.counter(
+    "pixerest_download_bytes_total", "Bytes proxied by /download_image.")
+images_served = registry.counter(
+    "pixerest_images_served_total", "Images returned to clients, by source.", ("source",))
+
+
+def count_images(images):
+    """Count served records per source and hand them back unchanged."""
+    per_source = {}
+    for img in images:
+        source = img.get("source", "unknown") if isinstance(img, dict) else "wallpaperflare"
+        per_source[source] = per_source.get(source, 0) + 1
+    for source, count in per_source.items():
+        images_served.inc(source, amount=count)
+    return images
+
+
+class Profile:
+    """Named timings collected while one request is served."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+
+    def add(self, name, seconds):
+        self.spans.append((name, seconds))
+
+    def server_timing(self):
+        total = time.perf_counter() - self.started
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.spans]
+        parts.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+
+@contextmanager
+def span(name):
+    """Record how long the block takes in the active profile, if any."""
+    profile = current_profile.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, time.perf_counter() - started)
+
+
+def record_span(name, seconds):
+    profile = current_profile.get()
+    if profile is not None:
+        profile.add(name, seconds)
@@ -0,0 +1,131 @@
+import json
+import logging
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import http_client
+from health import provider_health
+
+logger = logging.getLogger(__name__)
+
+
+# NEKO POOL SETTINGS
+# nekos.life returns one URL per call, so URLs are prefetched in the
+# background and requests just pop from the pool. A refill starts when the
+# pool drops below NEKO_POOL_LOW and tops it up to NEKO_POOL_HIGH.
+NEKO_API_URL = os.environ.get("NEKO_API_URL", "https://nekos.life/api/v2/img/neko")
+NEKO_POOL_LOW = int(os.environ.get("NEKO_POOL_LOW", 30))
+NEKO_POOL_HIGH = int(os.environ.get("NEKO_POOL_HIGH", 120))
+NEKO_REFILL_WORKERS = int(os.environ.get("NEKO_REFILL_WORKERS", 6))
+NEKO_TIMEOUT = float(os.environ.get("NEKO_TIMEOUT", 5))
+# Optional JSON file the pool is saved to after each refill and loaded from on
+# start, so a restarted worker does not begin empty.
+NEKO_POOL_PATH = os.environ.get("NEKO_POOL_PATH")
+
+
+def fetch_neko_url():
+    neko = http_client.get(NEKO_API_URL, timeout=NEKO_TIMEOUT)
+    neko.raise_for_status()
+    return neko.json()["url"]
+
+
+class NekoPool:
+    def __init__(self, low=NEKO_POOL_LOW, high=NEKO_POOL_HIGH, path=NEKO_POOL_PATH):
+        self.low = low
+        self.high = high
+        self.path = path
+        self.urls = deque()
+        self.lock = threading.Lock()
+        self.wanted = threading.Event()
+        self.thread = None
+        self.counters = {"served": 0, "short": 0, "fetched": 0, "fetch_errors": 0}
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+            self.urls.extend(dict.fromkeys(saved[:self.high]))
+        except (OSError, ValueError) as e:
+            logger.warning("could not load neko pool from %s: %s", self.path, e)
+
+    def _save(self):
+        if not self.path:
+            return
+        with self.lock:
+            snapshot = list(self.urls)
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning("could not save neko pool to %s: %s", self.path, e)
+
+    def start(self):
+        # Started lazily from the request path so each gunicorn worker gets
+        # its own refiller thread after fork.
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.thread = threading.Thread(target=self._run, name="neko-refill", daemon=True)
+            self.thread.start()
+        self.wanted.set()
+
+    def take(self, count):
+        """Pop up to ``count`` URLs without doing any network I/O."""
+        self.start()
+        with self.lock:
+            taken = [self.urls.popleft() for _ in range(min(count, len(self.urls)))]
+            self.counters["served"] += len(taken)
+            if len(taken) < count:
+                self.counters["short"] += count - len(taken)
+            remaining = len(self.urls)
+        if remaining < self.low:
+            self.wanted.set()
+        return taken
+
+    def _run(self):
+        with ThreadPoolExecutor(max_workers=NEKO_REFILL_WORKERS, thread_name_prefix="neko-fetch") as executor:
+            while True:
+                self.wanted.wait()
+                self.wanted.clear()
+                self._refill(executor)
+
+    def _refill(self, executor):
+        with self.lock:
+            missing = self.high - len(self.urls)
+        if missing <= 0:
+            return
+
+        futures = [
+            executor.submit(provider_health.call, "nekos", fetch_neko_url, NEKO_TIMEOUT)
+            for _ in range(missing)
+        ]
+        for future in futures:
+            try:
+                url = future.result()
+            except Exception:
+                with self.lock:
+                    self.counters["fetch_errors"] += 1
+                continue
+            with self.lock:
+                if url not in self.urls and len(self.urls) < self.high:
+                    self.urls.append(url)
+                    self.counters["fetched"] += 1
+        self._save()
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["size"] = len(self.urls)
+        stats["low"] = self.low
+        stats["high"] = self.high
+        return stats
+
+
+neko_pool = NekoPool()
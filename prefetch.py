@@ -0,0 +1,86 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+# SPECULATIVE PREFETCH SETTINGS
+# After a page is served, the next PREFETCH_DEPTH pages of the same query are
+# warmed into the response cache in the background. At most PREFETCH_WORKERS
+# run at once; when more than PREFETCH_MAX_PENDING are queued the oldest are
+# cancelled, and a queued task that waited longer than PREFETCH_MAX_DELAY
+# seconds is dropped because the user has most likely moved on.
+PREFETCH_DEPTH = int(os.environ.get("PREFETCH_DEPTH", 1))
+PREFETCH_WORKERS = int(os.environ.get("PREFETCH_WORKERS", 2))
+PREFETCH_MAX_PENDING = int(os.environ.get("PREFETCH_MAX_PENDING", 8))
+PREFETCH_MAX_DELAY = float(os.environ.get("PREFETCH_MAX_DELAY", 5))
+# How long a warmed page counts towards the hit rate if nobody asks for it.
+PREFETCH_HIT_WINDOW = float(os.environ.get("PREFETCH_HIT_WINDOW", 300))
+
+
+class Prefetcher:
+    def __init__(self, warm, depth=PREFETCH_DEPTH):
+        self.warm = warm
+        self.depth = depth
+        self.executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+        self.lock = threading.Lock()
+        self.pending = OrderedDict()
+        self.warmed = OrderedDict()
+        self.counters = {"scheduled": 0, "completed": 0, "cancelled": 0, "expired": 0, "failed": 0, "hits": 0}
+
+    def key(self, query, page, per_page):
+        return (query.strip().lower(), page, per_page)
+
+    def record_request(self, query, page, per_page):
+        """Note a real page request; counts a hit if that page was prefetched."""
+        key = self.key(query, page, per_page)
+        now = time.monotonic()
+        with self.lock:
+            warmed_at = self.warmed.pop(key, None)
+            if warmed_at is not None and now - warmed_at < PREFETCH_HIT_WINDOW:
+                self.counters["hits"] += 1
+
+    def schedule(self, query, page, per_page, total_pages):
+        for next_page in range(page + 1, min(page + self.depth, total_pages) + 1):
+            key = self.key(query, next_page, per_page)
+            with self.lock:
+                if key in self.pending or key in self.warmed:
+                    continue
+                while len(self.pending) >= PREFETCH_MAX_PENDING:
+                    _, oldest = self.pending.popitem(last=False)
+                    if oldest.cancel():
+                        self.counters["cancelled"] += 1
+                self.counters["scheduled"] += 1
+                self.pending[key] = self.executor.submit(self._run, key, time.monotonic(), query, next_page, per_page)
+
+    def _run(self, key, scheduled_at, query, page, per_page):
+        try:
+            if time.monotonic() - scheduled_at > PREFETCH_MAX_DELAY:
+                with self.lock:
+                    self.counters["expired"] += 1
+                return
+            self.warm(query, page, per_page)
+            with self.lock:
+                self.counters["completed"] += 1
+                self.warmed[key] = time.monotonic()
+                while len(self.warmed) > PREFETCH_MAX_PENDING * 32:
+                    self.warmed.popitem(last=False)
+        except Exception as e:
+            with self.lock:
+                self.counters["failed"] += 1
+            logger.warning("prefetch failed for %s: %s", key, e)
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["pending"] = len(self.pending)
+        stats["depth"] = self.depth
+        stats["hit_rate"] = round(stats["hits"] / stats["completed"], 4) if stats["completed"] else 0.0
+        return stats
@@ -0,0 +1,130 @@
+import os
+import threading
+import time
+
+
+# RATE LIMIT SETTINGS
+# One token bucket per provider API key, sized from <NAME>_RATE_LIMIT calls per
+# <NAME>_RATE_WINDOW seconds and corrected from the X-Ratelimit-* headers the
+# APIs send back. Lower-priority traffic has to leave a reserve in the bucket,
+# so prefetch and related-image calls stop first when the budget runs low.
+RATE_LIMITS = {
+    "unsplash": (int(os.environ.get("UNSPLASH_RATE_LIMIT", 50)), float(os.environ.get("UNSPLASH_RATE_WINDOW", 3600))),
+    "pexels": (int(os.environ.get("PEXELS_RATE_LIMIT", 200)), float(os.environ.get("PEXELS_RATE_WINDOW", 3600))),
+    "artic": (int(os.environ.get("ARTIC_RATE_LIMIT", 60)), float(os.environ.get("ARTIC_RATE_WINDOW", 60))),
+}
+
+PRIORITY_FIRST_PAGE = 0
+PRIORITY_USER = 1
+PRIORITY_BACKGROUND = 2
+
+# Share of the bucket each priority must leave untouched.
+RESERVES = {
+    PRIORITY_FIRST_PAGE: 0.0,
+    PRIORITY_USER: float(os.environ.get("RATE_RESERVE_USER", 0.1)),
+    PRIORITY_BACKGROUND: float(os.environ.get("RATE_RESERVE_BACKGROUND", 0.3)),
+}
+
+# Used when a 429 arrives without a reset time.
+RATE_LIMITED_BACKOFF = float(os.environ.get("RATE_LIMITED_BACKOFF", 60))
+
+
+class RateLimitedError(Exception):
+    """Raised instead of making a call the provider's budget cannot afford."""
+
+
+class TokenBucket:
+    def __init__(self, name, capacity, window):
+        self.name = name
+        self.capacity = capacity
+        self.rate = capacity / window
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+        self.counters = {"granted": 0, "denied": 0, "refunded": 0, "throttled_by_upstream": 0}
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, priority):
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            reserve = self.capacity * RESERVES.get(priority, 0.0)
+            if now < self.blocked_until or self.tokens < 1 + reserve:
+                self.counters["denied"] += 1
+                raise RateLimitedError(f"{self.name} rate budget exhausted for priority {priority}")
+            self.tokens -= 1
+            self.counters["granted"] += 1
+
+    def refund(self):
+        """Give back a token whose call was never made."""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens + 1)
+            self.counters["refunded"] += 1
+
+    def observe(self, status_code, headers):
+        """Correct the bucket from an upstream response."""
+        limit = _int_header(headers, "X-Ratelimit-Limit")
+        remaining = _int_header(headers, "X-Ratelimit-Remaining")
+        reset = _int_header(headers, "X-Ratelimit-Reset")
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            if limit:
+                window = self.capacity / self.rate
+                self.capacity = limit
+                self.rate = limit / window
+            if remaining is not None:
+                self.tokens = min(self.tokens, float(remaining))
+            if status_code == 429 or remaining == 0:
+                self.counters["throttled_by_upstream"] += 1
+                self.tokens = 0.0
+                wait = reset - time.time() if reset and reset > time.time() else RATE_LIMITED_BACKOFF
+                self.blocked_until = now + wait
+
+    def snapshot(self):
+        with self.lock:
+            self._refill(time.monotonic())
+            stats = dict(self.counters)
+            stats["tokens"] = round(self.tokens, 2)
+            stats["capacity"] = self.capacity
+            stats["blocked_for"] = round(max(self.blocked_until - time.monotonic(), 0), 1)
+        return stats
+
+
+def _int_header(headers, name):
+    value = headers.get(name)
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class RateLimiter:
+    def __init__(self, limits=RATE_LIMITS):
+        self.buckets = {name: TokenBucket(name, capacity, window) for name, (capacity, window) in limits.items()}
+
+    def acquire(self, name, priority=PRIORITY_USER):
+        bucket = self.buckets.get(name)
+        if bucket is not None:
+            bucket.acquire(priority)
+
+    def refund(self, name):
+        bucket = self.buckets.get(name)
+        if bucket is not None:
+            bucket.refund()
+
+    def observe(self, name, status_code, headers):
+        bucket = self.buckets.get(name)
+        if bucket is not None:
+            bucket.observe(status_code, headers)
+
+    def snapshot(self):
+        return {name: bucket.snapshot() for name, bucket in self.buckets.items()}
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,93 @@
+import gzip
+import hashlib
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    # The stdlib encoder below still works, just slower.
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# JSON RESPONSE SETTINGS
+# Bodies are encoded once, tagged with a strong ETag (a hash of the bytes) and
+# compressed with brotli (when installed) or gzip if the client accepts it and
+# the body is at least COMPRESS_MIN_BYTES. RESPONSE_DEBUG=0 drops the "debug"
+# blocks, which are only useful while developing.
+RESPONSE_DEBUG = os.environ.get("RESPONSE_DEBUG", "1") == "1"
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", 1024))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", 5))
+
+
+def dumps(payload):
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(",", ":")).encode()
+
+
+def public_payload(payload):
+    if RESPONSE_DEBUG or "debug" not in payload:
+        return payload
+    return {key: value for key, value in payload.items() if key != "debug"}
+
+
+def pick_encoding(accept_encoding):
+    """The best content coding we can produce that the client accepts (None = identity)."""
+    offered = {}
+    for part in (accept_encoding or "").lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        offered[coding.strip()] = quality
+    for coding in (["br"] if brotli is not None else []) + ["gzip"]:
+        if offered.get(coding, offered.get("*", 0)) > 0:
+            return coding
+    return None
+
+
+def compress(body, coding):
+    if coding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # W/ prefixes are ignored: If-None-Match uses weak comparison.
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+
+def encode_json(payload, accept_encoding=None, if_none_match=None, cache_control="no-cache"):
+    """Serialize ``payload`` for a conditional, compressed JSON response.
+
+    Returns ``(status, body, headers)``; status is 304 with an empty body when
+    the client already holds this exact representation.
+    """
+    body = dumps(public_payload(payload))
+    digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+    coding = pick_encoding(accept_encoding) if len(body) >= COMPRESS_MIN_BYTES else None
+    # Each content coding is a different representation, so it gets its own strong tag.
+    etag = f'"{digest}-{coding}"' if coding else f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+
+    if etag_matches(if_none_match, etag):
+        return 304, b"", headers
+
+    if coding:
+        body = compress(body, coding)
+        headers["Content-Encoding"] = coding
+    return 200, body, headers
@@ -0,0 +1,288 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# LOCAL SEARCH INDEX SETTINGS
+# Image records seen in provider responses are written to a SQLite FTS5 index
+# in the background (one transaction every INDEX_FLUSH_INTERVAL seconds), so
+# repeated searches can be answered locally. A crawler walks the configured
+# queries INDEX_CRAWL_PAGES deep, one query every INDEX_CRAWL_INTERVAL / len(queries)
+# seconds; the crawls table makes sure only one worker crawls a query per
+# interval. The oldest records beyond INDEX_MAX_ROWS are dropped.
+# Pages harvested whole (WallpaperFlare) are also kept as listed, in the
+# listings table, and served as-is for INDEX_PAGE_MAX_AGE seconds.
+INDEX_ENABLED = os.environ.get("INDEX_ENABLED", "1") == "1"
+INDEX_DB = os.environ.get("INDEX_DB", "image_index.sqlite3")
+INDEX_FLUSH_INTERVAL = float(os.environ.get("INDEX_FLUSH_INTERVAL", 2))
+INDEX_PENDING_MAX = int(os.environ.get("INDEX_PENDING_MAX", 5000))
+INDEX_MAX_ROWS = int(os.environ.get("INDEX_MAX_ROWS", 200000))
+INDEX_CRAWL_INTERVAL = float(os.environ.get("INDEX_CRAWL_INTERVAL", 6 * 3600))  # 0 = no crawling
+INDEX_CRAWL_PAGES = int(os.environ.get("INDEX_CRAWL_PAGES", 2))
+INDEX_PAGE_MAX_AGE = float(os.environ.get("INDEX_PAGE_MAX_AGE", 24 * 3600))
+
+# Weights of the alt, author and queries columns in the bm25 ranking.
+RANK = "bm25(image_text, 1.0, 0.5, 2.0)"
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS images ("
+    "id INTEGER PRIMARY KEY, url TEXT NOT NULL UNIQUE, thumbnail TEXT NOT NULL, source TEXT NOT NULL, "
+    "alt TEXT NOT NULL, author TEXT NOT NULL, likes INTEGER NOT NULL, queries TEXT NOT NULL, seen_at REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS images_seen ON images (seen_at)",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS image_text USING fts5("
+    "alt, author, queries, content='images', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS images_ai AFTER INSERT ON images BEGIN "
+    "INSERT INTO image_text (rowid, alt, author, queries) VALUES (new.id, new.alt, new.author, new.queries); END",
+    "CREATE TRIGGER IF NOT EXISTS images_ad AFTER DELETE ON images BEGIN "
+    "INSERT INTO image_text (image_text, rowid, alt, author, queries) "
+    "VALUES ('delete', old.id, old.alt, old.author, old.queries); END",
+    "CREATE TRIGGER IF NOT EXISTS images_au AFTER UPDATE ON images BEGIN "
+    "INSERT INTO image_text (image_text, rowid, alt, author, queries) "
+    "VALUES ('delete', old.id, old.alt, old.author, old.queries); "
+    "INSERT INTO image_text (rowid, alt, author, queries) VALUES (new.id, new.alt, new.author, new.queries); END",
+    "CREATE TABLE IF NOT EXISTS crawls (query TEXT PRIMARY KEY, crawled_at REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS listings ("
+    "source TEXT NOT NULL, query TEXT NOT NULL, page INTEGER NOT NULL, position INTEGER NOT NULL, "
+    "image_id INTEGER NOT NULL, seen_at REAL NOT NULL, PRIMARY KEY (source, query, page, position))",
+]
+
+# A record found under another query gets that query appended to ``queries``
+# ("|cars|sunset|"), so it matches searches its alt text alone would miss.
+UPSERT = (
+    "INSERT INTO images (url, thumbnail, source, alt, author, likes, queries, seen_at) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(url) DO UPDATE SET thumbnail = excluded.thumbnail, alt = excluded.alt, "
+    "author = excluded.author, likes = excluded.likes, seen_at = excluded.seen_at, "
+    "queries = CASE WHEN instr(queries, excluded.queries) > 0 THEN queries "
+    "ELSE queries || substr(excluded.queries, 2) END"
+)
+
+
+def normalize_query(query):
+    return " ".join(re.findall(r"\w+", query.lower()))
+
+
+def match_expression(query):
+    """Every word of ``query`` as a quoted FTS5 term, so user input is never parsed as syntax."""
+    return " ".join(f'"{word}"' for word in normalize_query(query).split())
+
+
+class SearchIndex:
+    def __init__(self, crawl=None, queries=(), path=INDEX_DB):
+        self.crawl = crawl
+        self.queries = list(queries)
+        self.path = path
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.pending = []
+        self.pending_pages = []
+        self.flush_wanted = threading.Event()
+        self.threads = []
+        self.counters = {"searches": 0, "answered": 0, "page_lookups": 0, "pages_answered": 0, "harvested": 0,
+                         "dropped": 0, "flushes": 0, "crawls": 0, "crawl_errors": 0, "trimmed": 0}
+        if INDEX_ENABLED:
+            conn = self._connect()
+            for statement in SCHEMA:
+                conn.execute(statement)
+
+    def _connect(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def _start(self):
+        # Lazy so every gunicorn worker starts its own threads after fork.
+        if self.threads and all(thread.is_alive() for thread in self.threads):
+            return
+        self.threads = [threading.Thread(target=self._run_writer, name="index-writer", daemon=True)]
+        if self.crawl is not None and self.queries and INDEX_CRAWL_INTERVAL > 0:
+            self.threads.append(threading.Thread(target=self._run_crawler, name="index-crawler", daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def search(self, query, offset, limit, sources=None):
+        """Return ``(records, total_matches)`` for ``query``, best matches first.
+
+        ``sources`` restricts the results to records from those providers.
+        """
+        expression = match_expression(query)
+        # SQLite reads a negative LIMIT as "no limit".
+        if not INDEX_ENABLED or not expression or limit <= 0:
+            return [], 0
+        offset = max(offset, 0)
+        with self.lock:
+            self._start()
+            self.counters["searches"] += 1
+
+        where = "image_text MATCH ?"
+        params = [expression]
+        if sources:
+            where += f" AND images.source IN ({','.join('?' * len(sources))})"
+            params += list(sources)
+        conn = self._connect()
+        try:
+            total = conn.execute(
+                f"SELECT COUNT(*) FROM image_text JOIN images ON images.id = image_text.rowid WHERE {where}", params
+            ).fetchone()[0]
+            rows = conn.execute(
+                "SELECT images.url, images.thumbnail, images.source, images.alt, images.author, images.likes "
+                f"FROM image_text JOIN images ON images.id = image_text.rowid WHERE {where} "
+                f"ORDER BY {RANK}, images.id LIMIT ? OFFSET ?",
+                params + [limit, offset],
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning("index search failed for %r: %s", query, e)
+            return [], 0
+
+        if rows:
+            with self.lock:
+                self.counters["answered"] += 1
+        return [{
+            "url": url,
+            "thumbnail": thumbnail,
+            "source": source_name,
+            "alt": alt,
+            "author": author,
+            "likes": likes
+        } for url, thumbnail, source_name, alt, author, likes in rows], total
+
+    def listed_page(self, source, query, page):
+        """URLs of ``page`` of ``query`` exactly as ``source`` listed it, or None if not held (or too old)."""
+        if not INDEX_ENABLED or not normalize_query(query):
+            return None
+        with self.lock:
+            self._start()
+            self.counters["page_lookups"] += 1
+
+        try:
+            rows = self._connect().execute(
+                "SELECT images.url, listings.seen_at FROM listings JOIN images ON images.id = listings.image_id "
+                "WHERE listings.source = ? AND listings.query = ? AND listings.page = ? ORDER BY listings.position",
+                (source, normalize_query(query), page),
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning("index page lookup failed for %r page %s: %s", query, page, e)
+            return None
+        if not rows or rows[0][1] < time.time() - INDEX_PAGE_MAX_AGE:
+            return None
+
+        with self.lock:
+            self.counters["pages_answered"] += 1
+        return [url for url, _ in rows]
+
+    def harvest(self, query, images, page=None):
+        """Queue provider records for the index; never blocks the request.
+
+        With ``page``, ``images`` is that whole page of one source's results
+        for ``query`` and is also kept as a listing for ``listed_page``.
+        """
+        if not INDEX_ENABLED or not images:
+            return
+        tag = f"|{normalize_query(query)}|" if normalize_query(query) else "|"
+        now = time.time()
+        rows = [(img["url"], img["thumbnail"], img["source"], img.get("alt") or "", img.get("author") or "",
+                 img.get("likes") or 0, tag, now) for img in images]
+        with self.lock:
+            self._start()
+            room = INDEX_PENDING_MAX - len(self.pending)
+            self.pending.extend(rows[:max(room, 0)])
+            self.counters["dropped"] += max(len(rows) - max(room, 0), 0)
+            # A listing is only worth keeping if every one of its records made it in.
+            if page is not None and normalize_query(query) and len(rows) <= room:
+                self.pending_pages.append((images[0]["source"], normalize_query(query), page,
+                                           [img["url"] for img in images], now))
+
+    def _run_writer(self):
+        while True:
+            self.flush_wanted.wait(INDEX_FLUSH_INTERVAL)
+            self.flush_wanted.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logger.warning("index flush failed: %s", e)
+
+    def flush(self):
+        with self.lock:
+            batch, self.pending = self.pending, []
+            pages, self.pending_pages = self.pending_pages, []
+        if not batch:
+            return
+
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(UPSERT, batch)
+            for source, query, page, urls, seen_at in pages:
+                conn.execute("DELETE FROM listings WHERE source = ? AND query = ? AND page = ?", (source, query, page))
+                conn.executemany(
+                    "INSERT INTO listings (source, query, page, position, image_id, seen_at) "
+                    "SELECT ?, ?, ?, ?, id, ? FROM images WHERE url = ?",
+                    [(source, query, page, position, seen_at, url) for position, url in enumerate(urls)],
+                )
+            trimmed = conn.execute(
+                "DELETE FROM images WHERE id IN ("
+                "SELECT id FROM images ORDER BY seen_at DESC LIMIT -1 OFFSET ?)",
+                (INDEX_MAX_ROWS,),
+            ).rowcount
+            if trimmed > 0:
+                # A listing with a record missing would be served short; drop it whole.
+                conn.execute(
+                    "DELETE FROM listings WHERE (source, query, page) IN ("
+                    "SELECT source, query, page FROM listings WHERE image_id NOT IN (SELECT id FROM images))"
+                )
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+
+        with self.lock:
+            self.counters["flushes"] += 1
+            self.counters["harvested"] += len(batch)
+            self.counters["trimmed"] += max(trimmed, 0)
+
+    def claim_crawl(self, query):
+        """True if this worker should crawl ``query`` now (no one did within the interval)."""
+        now = time.time()
+        claimed = self._connect().execute(
+            "INSERT INTO crawls (query, crawled_at) VALUES (?, ?) "
+            "ON CONFLICT(query) DO UPDATE SET crawled_at = excluded.crawled_at WHERE crawled_at < ?",
+            (query, now, now - INDEX_CRAWL_INTERVAL),
+        ).rowcount
+        return claimed == 1
+
+    def _run_crawler(self):
+        # Staggered: one query per slot, so a full pass takes INDEX_CRAWL_INTERVAL.
+        slot = INDEX_CRAWL_INTERVAL / len(self.queries)
+        while True:
+            for query in self.queries:
+                try:
+                    if self.claim_crawl(query):
+                        for page in range(1, INDEX_CRAWL_PAGES + 1):
+                            self.crawl(query, page)
+                        with self.lock:
+                            self.counters["crawls"] += 1
+                        time.sleep(slot)
+                except Exception as e:
+                    with self.lock:
+                        self.counters["crawl_errors"] += 1
+                    logger.warning("index crawl failed for %r: %s", query, e)
+            # Everything was crawled recently (possibly by another worker).
+            time.sleep(slot)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["pending"] = len(self.pending)
+        if INDEX_ENABLED:
+            stats["rows"] = self._connect().execute("SELECT COUNT(*) FROM images").fetchone()[0]
+        return stats
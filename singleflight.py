@@ -0,0 +1,82 @@
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into one execution.
+
+    The first caller for a key runs ``fn``; everyone who asks for the same key
+    while it is running blocks and receives the same result (or exception).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.counters = {"executed": 0, "coalesced": 0}
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.counters["coalesced"] += 1
+                leader = False
+            else:
+                call = self.calls[key] = _Call()
+                self.counters["executed"] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = fn()
+            except Exception as e:
+                call.error = e
+            finally:
+                with self.lock:
+                    del self.calls[key]
+                call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["in_flight"] = len(self.calls)
+        return stats
+
+
+class AsyncSingleFlight:
+    """``SingleFlight`` for coroutines running on one event loop."""
+
+    def __init__(self):
+        self.calls = {}
+        self.counters = {"executed": 0, "coalesced": 0}
+
+    async def do(self, key, fn):
+        future = self.calls.get(key)
+        if future is not None:
+            self.counters["coalesced"] += 1
+            return await asyncio.shield(future)
+
+        self.counters["executed"] += 1
+        future = self.calls[key] = asyncio.ensure_future(fn())
+        future.add_done_callback(lambda _: self.calls.pop(key, None))
+        # Shielded so a caller that times out does not cancel the shared fetch.
+        return await asyncio.shield(future)
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats["in_flight"] = len(self.calls)
+        return stats
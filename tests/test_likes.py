@@ -0,0 +1,47 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from likes import LikeStore
+
+
+class LikeStoreFlushTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "likes.sqlite3")
+        self.store = LikeStore(self.path)
+        # Fail straight away instead of waiting out the 5 second busy timeout.
+        self.store._connect().execute("PRAGMA busy_timeout=0")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def stored(self, url):
+        row = sqlite3.connect(self.path).execute("SELECT count FROM likes WHERE url = ?", (url,)).fetchone()
+        return row[0] if row else 0
+
+    def test_failed_flush_keeps_the_batch(self):
+        with self.store.lock:
+            self.store.pending["a"] = 2
+
+        # Another worker holds the write lock, so BEGIN IMMEDIATE fails.
+        blocker = sqlite3.connect(self.path, isolation_level=None)
+        blocker.execute("BEGIN IMMEDIATE")
+        with self.assertRaises(sqlite3.OperationalError):
+            self.store.flush()
+
+        self.assertEqual(self.store.pending, {"a": 2})
+        self.assertEqual(self.store.counts(["a"]), {"a": 2})
+        self.assertEqual(self.stored("a"), 0)
+
+        blocker.execute("ROLLBACK")
+        self.store.flush()
+
+        self.assertEqual(self.store.pending, {})
+        self.assertEqual(self.store.counts(["a"]), {"a": 2})
+        self.assertEqual(self.stored("a"), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
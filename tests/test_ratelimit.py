@@ -0,0 +1,56 @@
+import asyncio
+import time
+import unittest
+from unittest import mock
+
+import app
+import asgi
+from health import OPEN, CircuitOpenError, ProviderRegistry
+from ratelimit import PRIORITY_FIRST_PAGE, RateLimiter
+
+
+class OpenBreakerTokenTest(unittest.TestCase):
+    def setUp(self):
+        self.limiter = RateLimiter({"unsplash": (5, 3600)})
+        self.health = ProviderRegistry(["unsplash"])
+        breaker = self.health["unsplash"]
+        breaker.state = OPEN
+        breaker.opened_at = time.monotonic()
+
+        self.upstream = mock.Mock(side_effect=AssertionError("upstream called with the breaker open"))
+        patches = [
+            mock.patch.object(app, "rate_limiter", self.limiter),
+            mock.patch.object(app, "provider_health", self.health),
+            mock.patch.object(asgi, "rate_limiter", self.limiter),
+            mock.patch.object(asgi, "provider_health", self.health),
+            mock.patch.dict(app.PROVIDERS, {"unsplash": self.upstream}),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def assert_budget_untouched(self):
+        stats = self.limiter.snapshot()["unsplash"]
+        self.assertEqual(stats["tokens"], 5)
+        self.assertEqual(stats["denied"], 0)
+
+    def test_sync_calls_refund_their_token(self):
+        # More calls than the bucket holds: without refunds the last ones would be denied.
+        for page in range(1, 12):
+            with self.assertRaises(CircuitOpenError):
+                app.cached_provider_call("unsplash", "rate-test", page, 10, 10, PRIORITY_FIRST_PAGE)
+        self.assert_budget_untouched()
+        self.upstream.assert_not_called()
+
+    def test_async_calls_refund_their_token(self):
+        async def run():
+            for page in range(1, 12):
+                with self.assertRaises(CircuitOpenError):
+                    await asgi.cached_provider_call("unsplash", "rate-test-async", page, 10, 10, PRIORITY_FIRST_PAGE)
+
+        asyncio.run(run())
+        self.assert_budget_untouched()
+
+
+if __name__ == "__main__":
+    unittest.main()
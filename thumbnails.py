@@ -0,0 +1,162 @@
+import hashlib
+import os
+import threading
+from io import BytesIO
+from urllib.parse import quote, urlparse
+
+from PIL import Image
+
+import http_client
+from singleflight import SingleFlight
+
+
+# THUMBNAIL PROXY SETTINGS
+# Thumbnails are fetched once, downscaled to one of THUMB_WIDTHS, re-encoded
+# as WebP and kept on disk under a hash of (url, width). The directory is
+# trimmed back to THUMB_CACHE_MAX_BYTES, least recently used first.
+THUMB_CACHE_DIR = os.environ.get("THUMB_CACHE_DIR", "thumb_cache")
+THUMB_CACHE_MAX_BYTES = int(os.environ.get("THUMB_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+THUMB_WIDTHS = [int(w) for w in os.environ.get("THUMB_WIDTHS", "160,320,480,640,960").split(",")]
+THUMB_DEFAULT_WIDTH = int(os.environ.get("THUMB_DEFAULT_WIDTH", 480))
+THUMB_QUALITY = int(os.environ.get("THUMB_QUALITY", 75))
+THUMB_SOURCE_MAX_BYTES = int(os.environ.get("THUMB_SOURCE_MAX_BYTES", 25 * 1024 * 1024))
+THUMB_ALLOWED_HOSTS = os.environ.get(
+    "THUMB_ALLOWED_HOSTS", "unsplash.com,pexels.com,nekos.life,artic.edu,wallpaperflare.com"
+).split(",")
+# Set THUMB_PROXY=0 to hand provider thumbnail URLs straight to the browser.
+THUMB_PROXY = os.environ.get("THUMB_PROXY", "1") != "0"
+
+
+class ThumbnailError(Exception):
+    """Raised when a thumbnail cannot be fetched or decoded."""
+
+
+def pick_width(requested):
+    """Snap a requested width to the next configured size, so the cache stays small."""
+    for width in sorted(THUMB_WIDTHS):
+        if width >= requested:
+            return width
+    return max(THUMB_WIDTHS)
+
+
+def is_allowed(url):
+    parsed = urlparse(url)
+    host = parsed.hostname or ""
+    return parsed.scheme in ("http", "https") and any(
+        host == allowed or host.endswith("." + allowed) for allowed in THUMB_ALLOWED_HOSTS
+    )
+
+
+def thumb_url(url, width=THUMB_DEFAULT_WIDTH):
+    if not THUMB_PROXY or not url or not is_allowed(url):
+        return url
+    return f"/thumb?url={quote(url, safe='')}&w={pick_width(width)}"
+
+
+class ThumbnailCache:
+    def __init__(self, directory=THUMB_CACHE_DIR, max_bytes=THUMB_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.flight = SingleFlight()
+        self.lock = threading.Lock()
+        self.writes_since_trim = 0
+        self.counters = {"hits": 0, "misses": 0, "errors": 0, "evictions": 0}
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, url, width):
+        return hashlib.sha256(f"{url}|{width}|webp|{THUMB_QUALITY}".encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.webp")
+
+    def get(self, url, width):
+        """Return ``(path, key)`` for the thumbnail, rendering it on first use."""
+        key = self.key(url, width)
+        path = self.path(key)
+        if os.path.exists(path):
+            with self.lock:
+                self.counters["hits"] += 1
+            os.utime(path)
+            return path, key
+
+        with self.lock:
+            self.counters["misses"] += 1
+        try:
+            self.flight.do(key, lambda: self._render(url, width, path))
+        except Exception:
+            with self.lock:
+                self.counters["errors"] += 1
+            raise
+        return path, key
+
+    def _render(self, url, width, path):
+        if os.path.exists(path):
+            return
+        with http_client.get(url, stream=True, timeout=10) as response:
+            if not response.ok:
+                raise ThumbnailError(f"Status {response.status_code} for {url}")
+            buffer = BytesIO()
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                buffer.write(chunk)
+                if buffer.tell() > THUMB_SOURCE_MAX_BYTES:
+                    raise ThumbnailError(f"Source image larger than {THUMB_SOURCE_MAX_BYTES} bytes")
+
+        buffer.seek(0)
+        try:
+            with Image.open(buffer) as image:
+                # draft() lets the JPEG decoder downscale while decoding.
+                image.draft("RGB", (width, width * 4))
+                image.thumbnail((width, width * 4))
+                if image.mode not in ("RGB", "RGBA"):
+                    image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+                encoded = BytesIO()
+                image.save(encoded, "WEBP", quality=THUMB_QUALITY, method=4)
+        except (OSError, ValueError) as e:
+            raise ThumbnailError(f"Could not decode {url}: {e}")
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(encoded.getvalue())
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            self.writes_since_trim += 1
+            due = self.writes_since_trim >= 50
+            if due:
+                self.writes_since_trim = 0
+        if due:
+            self.trim()
+
+    def trim(self):
+        """Delete least recently used thumbnails until the cache fits its budget."""
+        files = []
+        total = 0
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                file_path = os.path.join(root, name)
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, file_path))
+                total += stat.st_size
+
+        files.sort()
+        for _, size, file_path in files:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                continue
+            total -= size
+            with self.lock:
+                self.counters["evictions"] += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
+
+
+thumbnail_cache = ThumbnailCache()
@@ -0,0 +1,93 @@
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+# WALLPAPER POOL SETTINGS
+# /wallpaper/random is served from memory. A background scheduler keeps one
+# slot per (query, page) for WALLPAPER_POOL_PAGES pages of every random query:
+# empty slots are filled first, WALLPAPER_POOL_WORKERS at a time, then the
+# stalest slot is re-scraped every WALLPAPER_POOL_REFRESH / slots seconds, so
+# each slot is refreshed once per WALLPAPER_POOL_REFRESH without bursts.
+# WALLPAPER_POOL_MAX_URLS caps the URLs held across all slots.
+WALLPAPER_POOL_PAGES = int(os.environ.get("WALLPAPER_POOL_PAGES", 3))
+WALLPAPER_POOL_REFRESH = float(os.environ.get("WALLPAPER_POOL_REFRESH", 1800))
+WALLPAPER_POOL_WORKERS = int(os.environ.get("WALLPAPER_POOL_WORKERS", 4))
+WALLPAPER_POOL_MAX_URLS = int(os.environ.get("WALLPAPER_POOL_MAX_URLS", 3000))
+
+
+class WallpaperPool:
+    def __init__(self, fetch, queries, pages=WALLPAPER_POOL_PAGES, max_urls=WALLPAPER_POOL_MAX_URLS):
+        self.fetch = fetch
+        self.slots = {(query, page): None for query in queries for page in range(1, pages + 1)}
+        self.per_slot = max(max_urls // len(self.slots), 1)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.counters = {"served": 0, "cold": 0, "refreshes": 0, "refresh_errors": 0}
+
+    def start(self):
+        # Started lazily from the request path so each gunicorn worker gets
+        # its own scheduler thread after fork.
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.thread = threading.Thread(target=self._run, name="wallpaper-pool", daemon=True)
+            self.thread.start()
+
+    def random_page(self):
+        """Return ``(query, page, urls)`` for a random filled slot, or None while the pool is cold."""
+        self.start()
+        with self.lock:
+            filled = [(key, slot["urls"]) for key, slot in self.slots.items() if slot]
+            if not filled:
+                self.counters["cold"] += 1
+                return None
+            self.counters["served"] += 1
+        (query, page), urls = random.choice(filled)
+        return query, page, urls
+
+    def _refresh(self, key):
+        query, page = key
+        try:
+            urls = self.fetch(query, page)
+        except Exception as e:
+            urls = []
+            logger.warning("wallpaper pool refresh failed for %r page %s: %s", query, page, e)
+        with self.lock:
+            if not urls:
+                # Keep serving the previous scrape rather than an empty slot.
+                self.counters["refresh_errors"] += 1
+                if self.slots[key]:
+                    self.slots[key]["refreshed_at"] = time.monotonic()
+                return
+            self.slots[key] = {"urls": urls[:self.per_slot], "refreshed_at": time.monotonic()}
+            self.counters["refreshes"] += 1
+
+    def _run(self):
+        empty = [key for key, slot in self.slots.items() if not slot]
+        random.shuffle(empty)
+        with ThreadPoolExecutor(max_workers=WALLPAPER_POOL_WORKERS, thread_name_prefix="wallpaper-fill") as executor:
+            list(executor.map(self._refresh, empty))
+
+        spacing = WALLPAPER_POOL_REFRESH / len(self.slots)
+        while True:
+            time.sleep(spacing)
+            with self.lock:
+                stalest = min(self.slots, key=lambda key: self.slots[key]["refreshed_at"] if self.slots[key] else 0)
+            self._refresh(stalest)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            filled = [slot for slot in self.slots.values() if slot]
+            stats["slots"] = len(self.slots)
+            stats["filled"] = len(filled)
+            stats["urls"] = sum(len(slot["urls"]) for slot in filled)
+            now = time.monotonic()
+            stats["oldest_age"] = round(max((now - slot["refreshed_at"] for slot in filled), default=0), 1)
+        return stats